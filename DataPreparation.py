@@ -1,5 +1,5 @@
-import pandas as pd
 import matplotlib.pyplot as plt
+from DatasetCreation import read_dataset
 
 #UTILITY FUNCTIONS
 
@@ -12,15 +12,13 @@ def remove_rows(data):
     data = data[data["tipo_veicoli__b_"].notnull()].dropna(subset=["veicolo__b___et__conducente"])
     return data
 
-#READ DATA
-data2018 = pd.read_csv("Dataset/INCSTRAD_Microdati_2018.csv")
-data2019 = pd.read_csv("Dataset/INCSTRAD_Microdati_2019.csv")
-data2020 = pd.read_csv("Dataset/INCSTRAD_Microdati_2020.csv")
-data2021 = pd.read_csv("Dataset/INCSTRAD_Microdati_2021.csv")
-data2022 = pd.read_csv("Dataset/INCSTRAD_Microdati_2022.csv")
+#READ DATA (only the columns used below)
+columns = ["veicolo__a___et__conducente", "Ora", "giorno", "tipo_veicoli__b_",
+           "veicolo__b___sesso_conducente", "veicolo__b___et__conducente", "morti"]
+years = [2018, 2019, 2020, 2021, 2022]
 
 #add all data in a single array
-data = [data2018, data2019, data2020, data2021, data2022]
+data = [read_dataset(columns=columns, years=[year]) for year in years]
 
 #execute remove_rows function for each dataset
 for i in range(len(data)):
@@ -30,7 +28,6 @@ for i in range(len(data)):
 
 
 #plot the number of accidents per year
-years = [2018, 2019, 2020, 2021, 2022]
 #use data array
 accidents = [data[i].shape[0] for i in range(len(data))]
 #build histogram
@@ -0,0 +1,440 @@
+import argparse
+import calendar
+import os
+import shutil
+import sqlite3
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import DatasetCreation
+
+DB_PATH = "dbAccidents.db"
+DIMENSIONS_DIR = "Dataset/Dimensioni"
+
+# Tabelle di dimensione lette da CSV: nome tabella -> colonne (nell'ordine del CSV)
+DIMENSIONS = {
+    "regioni": ["id", "regione", "Area", "popolazione"],
+    "province_regioni": ["idProvincia", "provincia", "popolazione", "idRegione", "regione"],
+    "tipo_veicolo": ["id", "descrizione", "gruppo"],
+}
+
+SCHEMA = """
+CREATE TABLE giorno (
+    id INTEGER PRIMARY KEY,
+    giorno TEXT NOT NULL
+);
+CREATE TABLE regioni (
+    id INTEGER PRIMARY KEY,
+    regione TEXT,
+    Area TEXT,
+    popolazione INTEGER
+);
+CREATE TABLE province_regioni (
+    idProvincia INTEGER PRIMARY KEY,
+    provincia TEXT,
+    popolazione INTEGER,
+    idRegione INTEGER REFERENCES regioni(id),
+    regione TEXT
+);
+CREATE TABLE tipo_veicolo (
+    id INTEGER PRIMARY KEY,
+    descrizione TEXT,
+    gruppo TEXT
+);
+CREATE TABLE fascia_eta (
+    id INTEGER PRIMARY KEY,
+    fascia TEXT NOT NULL,
+    minorenne INTEGER NOT NULL
+);
+CREATE TABLE incidenti (
+    id INTEGER PRIMARY KEY,
+    anno INTEGER NOT NULL,
+    idProvincia INTEGER,
+    idGiorno INTEGER,
+    Mese INTEGER,
+    Ora INTEGER,
+    idTipoVeicoloA INTEGER,
+    idTipoVeicoloB INTEGER,
+    SessoConducenteA TEXT,
+    EtaConducenteA TEXT,
+    SessoConducenteB TEXT,
+    EtaConducenteB TEXT,
+    Morti INTEGER,
+    Feriti INTEGER
+);
+-- dimensione calendario: quante volte ogni giorno della settimana cade in ogni mese
+CREATE TABLE calendario (
+    anno INTEGER NOT NULL,
+    mese INTEGER NOT NULL,
+    nome_mese TEXT NOT NULL,
+    idGiorno INTEGER NOT NULL REFERENCES giorno(id),
+    giorni INTEGER NOT NULL,
+    fine_settimana INTEGER NOT NULL,
+    PRIMARY KEY (anno, mese, idGiorno)
+);
+-- una riga per incidente con le dimensioni già codificate (lato B nullo se manca il veicolo B):
+-- la leggono gli indici bitmap e i filtri incrociati della dashboard (Utils/facts.py)
+CREATE VIEW fatti AS
+SELECT i.id, i.anno, i.idProvincia, pr.idRegione, i.idGiorno AS day_id, i.Mese AS mese, i.Ora,
+       i.idTipoVeicoloA, i.idTipoVeicoloB, va.gruppo AS gruppoA, vb.gruppo AS gruppoB,
+       CASE i.SessoConducenteA WHEN 'M' THEN 1 WHEN 'F' THEN 2 ELSE 0 END AS sessoA,
+       CASE WHEN i.idTipoVeicoloB <> '' THEN CASE i.SessoConducenteB WHEN 'M' THEN 1 WHEN 'F' THEN 2 ELSE 0 END END AS sessoB,
+       COALESCE(fa.id, 0) AS fasciaA,
+       CASE WHEN i.idTipoVeicoloB <> '' THEN COALESCE(fb.id, 0) END AS fasciaB,
+       COALESCE(i.idTipoVeicoloB <> '', 0) AS conB,
+       i.Morti AS morti
+FROM incidenti i
+LEFT JOIN province_regioni pr ON i.idProvincia = pr.idProvincia
+LEFT JOIN tipo_veicolo va ON i.idTipoVeicoloA = va.id
+LEFT JOIN tipo_veicolo vb ON i.idTipoVeicoloB = vb.id
+-- le etichette dei microdati sono completate con spazi normali e non separabili
+LEFT JOIN fascia_eta fa ON TRIM(i.EtaConducenteA, ' ' || char(160)) = fa.fascia
+LEFT JOIN fascia_eta fb ON TRIM(i.EtaConducenteB, ' ' || char(160)) = fb.fascia;
+-- indici bitmap: per ogni valore, le righe di fatti (in ordine di id) che lo hanno
+CREATE TABLE bitmap_indici (
+    colonna TEXT NOT NULL,
+    valore NOT NULL,
+    righe INTEGER NOT NULL,
+    bitmap BLOB NOT NULL,
+    PRIMARY KEY (colonna, valore)
+);
+"""
+
+# quando è stato caricato ogni anno: la dashboard lo usa per capire quali anni sono cambiati
+LOADED_YEARS = """
+CREATE TABLE IF NOT EXISTS anni_caricati (
+    anno INTEGER PRIMARY KEY,
+    caricato_il TEXT NOT NULL
+);
+"""
+
+# Indici coprenti per le query della dashboard (filtro per anno + dimensione)
+INDEXES = """
+CREATE INDEX idx_incidenti_anno_provincia ON incidenti(anno, idProvincia);
+CREATE INDEX idx_incidenti_anno_giorno_ora ON incidenti(anno, idGiorno, Ora, Morti);
+CREATE INDEX idx_incidenti_anno_veicoli ON incidenti(anno, idTipoVeicoloA, idTipoVeicoloB);
+"""
+
+# Tabelle riassuntive (cubi) lette dalle sezioni della dashboard al posto di incidenti.
+# Ogni cubo è raggruppato per anno, così può essere ricalcolato un anno alla volta.
+ROLLUPS = {
+    # panoramica + geografia
+    "cubo_provincia": """
+        SELECT anno, idProvincia, COUNT(*) AS incidenti, SUM(Morti) AS morti
+        FROM incidenti
+        GROUP BY anno, idProvincia
+    """,
+    # giorni e orari
+    "cubo_giorno_ora": """
+        SELECT anno, idGiorno, Ora, COUNT(*) AS incidenti, SUM(Morti) AS morti
+        FROM incidenti
+        GROUP BY anno, idGiorno, Ora
+    """,
+    # calendario: mese × giorno della settimana × ora (i microdati non hanno il giorno del mese)
+    "cubo_calendario_ora": """
+        SELECT anno, Mese, idGiorno, Ora, COUNT(*) AS incidenti, SUM(Morti) AS morti
+        FROM incidenti
+        GROUP BY anno, Mese, idGiorno, Ora
+    """,
+    # veicoli: coppie (A, B) con entrambi i veicoli presenti
+    "cubo_veicoli": """
+        SELECT anno, idTipoVeicoloA, idTipoVeicoloB, COUNT(*) AS incidenti
+        FROM incidenti
+        WHERE idTipoVeicoloA IS NOT NULL AND idTipoVeicoloB IS NOT NULL
+        GROUP BY anno, idTipoVeicoloA, idTipoVeicoloB
+    """,
+    # conducenti: A sempre, B solo se il veicolo B è presente.
+    # Fascia d'età e sesso codificati come interi (0 = non indicato)
+    "cubo_conducenti": """
+        SELECT d.anno, d.ruolo, COALESCE(f.id, 0) AS idFascia,
+               CASE d.Sesso WHEN 'M' THEN 1 WHEN 'F' THEN 2 ELSE 0 END AS idSesso,
+               SUM(d.conducenti) AS conducenti
+        FROM (
+            SELECT anno, 'A' AS ruolo, SessoConducenteA AS Sesso, EtaConducenteA AS Eta, COUNT(*) AS conducenti
+            FROM incidenti
+            GROUP BY anno, SessoConducenteA, EtaConducenteA
+            UNION ALL
+            SELECT anno, 'B' AS ruolo, SessoConducenteB AS Sesso, EtaConducenteB AS Eta, COUNT(*) AS conducenti
+            FROM incidenti
+            WHERE idTipoVeicoloB <> '' AND idTipoVeicoloB IS NOT NULL
+            GROUP BY anno, SessoConducenteB, EtaConducenteB
+        ) d
+        -- le etichette dei microdati sono completate con spazi normali e non separabili
+        LEFT JOIN fascia_eta f ON TRIM(d.Eta, ' ' || char(160)) = f.fascia
+        GROUP BY d.anno, d.ruolo, idFascia, idSesso
+    """,
+}
+
+# Indici bitmap: nome -> colonne della vista fatti. Un incidente ha il valore
+# se almeno una delle colonne lo ha (es. sesso = conducente A o B).
+BITMAP_COLUMNS = {
+    "anno": ["anno"],
+    "regione": ["idRegione"],
+    "provincia": ["idProvincia"],
+    "giorno": ["day_id"],
+    "mese": ["mese"],
+    "ora": ["Ora"],
+    "gruppo": ["gruppoA", "gruppoB"],
+    "sesso": ["sessoA", "sessoB"],
+    "fascia": ["fasciaA", "fasciaB"],
+}
+
+# colonna del dataset Parquet (DatasetCreation.read_dataset) -> colonna tabella incidenti
+DATASET_COLUMNS = {
+    "anno": "anno",
+    "provincia": "idProvincia",
+    "giorno": "idGiorno",
+    "mese": "Mese",
+    "Ora": "Ora",
+    "tipo_veicolo_a": "idTipoVeicoloA",
+    "tipo_veicoli__b_": "idTipoVeicoloB",
+    "veicolo__a___sesso_conducente": "SessoConducenteA",
+    "veicolo__a___et__conducente": "EtaConducenteA",
+    "veicolo__b___sesso_conducente": "SessoConducenteB",
+    "veicolo__b___et__conducente": "EtaConducenteB",
+    "morti": "Morti",
+    "feriti": "Feriti",
+}
+
+INT_COLUMNS = ["anno", "idProvincia", "idGiorno", "Mese", "Ora", "idTipoVeicoloA", "idTipoVeicoloB", "Morti", "Feriti"]
+
+# giorni della settimana con il codice dei microdati ISTAT (1 = lunedì)
+GIORNI = [
+    (1, "Lunedì"), (2, "Martedì"), (3, "Mercoledì"), (4, "Giovedì"),
+    (5, "Venerdì"), (6, "Sabato"), (7, "Domenica"),
+]
+
+# fasce d'età dei microdati (id, etichetta senza spazi, minorenne); 0 = non indicata
+FASCE_ETA = [
+    (1, "0-5", 1), (2, "6-9", 1), (3, "10-14", 1), (4, "15-17", 1),
+    (5, "18-29", 0), (6, "30-44", 0), (7, "45-54", 0), (8, "55-64", 0), (9, "65+", 0),
+]
+
+MESI = ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+        "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"]
+
+# prime tre lettere del nome nella tabella giorno -> giorno della settimana di Python (lunedì = 0)
+WEEKDAYS = {"lun": 0, "mar": 1, "mer": 2, "gio": 3, "ven": 4, "sab": 5, "dom": 6}
+
+# Nei microdati il sesso può essere codificato (1/2) o già come lettera
+SESSO = {"1": "M", "2": "F", "M": "M", "F": "F"}
+
+
+def create_schema(conn):
+    conn.executescript(SCHEMA + LOADED_YEARS)
+
+
+def create_indexes(conn):
+    conn.executescript(INDEXES)
+
+
+def create_rollups(conn):
+    """Materializza i cubi di ROLLUPS a partire da incidenti"""
+    for table, query in ROLLUPS.items():
+        conn.execute(f"CREATE TABLE {table} AS {query}")
+        conn.execute(f"CREATE INDEX idx_{table}_anno ON {table}(anno)")
+
+
+def refresh_rollups(conn, anno):
+    """Ricalcola solo le righe dei cubi relative a un anno (a 2 cifre)"""
+    for table, query in ROLLUPS.items():
+        conn.execute(f"DELETE FROM {table} WHERE anno = ?", (anno,))
+        conn.execute(f"INSERT INTO {table} SELECT * FROM ({query}) WHERE anno = ?", (anno,))
+
+
+def create_bitmaps(conn):
+    """
+    Ricostruisce gli indici bitmap: un bit per riga di fatti in ordine di id,
+    compresso con np.packbits + zlib (le colonne hanno pochi valori distinti).
+    """
+    columns = sorted({col for cols in BITMAP_COLUMNS.values() for col in cols})
+    df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM fatti ORDER BY id", conn)
+    rows = []
+    for name, cols in BITMAP_COLUMNS.items():
+        values = pd.unique(pd.concat([df[col].dropna() for col in cols]))
+        for value in values:
+            mask = np.zeros(len(df), dtype=bool)
+            for col in cols:
+                mask |= (df[col] == value).to_numpy()
+            value = value.item() if isinstance(value, np.generic) else value
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)  # colonne B con NULL lette come float
+            rows.append((name, value, int(mask.sum()), zlib.compress(np.packbits(mask).tobytes())))
+    conn.execute("DELETE FROM bitmap_indici")
+    conn.executemany("INSERT INTO bitmap_indici (colonna, valore, righe, bitmap) VALUES (?, ?, ?, ?)", rows)
+
+
+def load_dimensions(conn, dimensions_dir=DIMENSIONS_DIR):
+    """Carica le tabelle di dimensione da Dataset/Dimensioni/<tabella>.csv"""
+    missing = [f"{table}.csv" for table in DIMENSIONS
+               if not os.path.exists(os.path.join(dimensions_dir, f"{table}.csv"))]
+    if missing:
+        raise FileNotFoundError(
+            f"mancano in {dimensions_dir}: {', '.join(missing)} "
+            "(popolazione ISTAT e tipi di veicolo; vedi README)"
+        )
+    for table, columns in DIMENSIONS.items():
+        df = pd.read_csv(os.path.join(dimensions_dir, f"{table}.csv"), usecols=columns)
+        placeholders = ",".join("?" * len(columns))
+        conn.executemany(
+            f"INSERT INTO {table} ({','.join(columns)}) VALUES ({placeholders})",
+            df[columns].astype(object).where(df[columns].notnull(), None).itertuples(index=False, name=None)
+        )
+    # giorni e fasce d'età sono fissi: non servono CSV
+    conn.executemany("INSERT INTO giorno (id, giorno) VALUES (?, ?)", GIORNI)
+    conn.executemany("INSERT INTO fascia_eta (id, fascia, minorenne) VALUES (?, ?, ?)", FASCE_ETA)
+
+
+def prepare_incidents(data):
+    """Converte un DataFrame di read_dataset nelle colonne della tabella incidenti"""
+    data = data[list(DATASET_COLUMNS)].rename(columns=DATASET_COLUMNS)
+
+    for col in INT_COLUMNS:
+        data[col] = data[col].astype("Int64")
+
+    # anno a due cifre, come atteso dalla dashboard (2000 + anno)
+    data["anno"] = data["anno"] % 100
+
+    for col in ["SessoConducenteA", "SessoConducenteB"]:
+        data[col] = data[col].astype("string").str.strip().map(SESSO)
+
+    return data
+
+
+def insert_incidents(conn, data):
+    """Inserimento bulk delle righe preparate con prepare_incidents"""
+    columns = list(data.columns)
+    rows = data.astype(object).where(data.notnull(), None).itertuples(index=False, name=None)
+    conn.executemany(
+        f"INSERT INTO incidenti ({','.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+        rows
+    )
+
+
+def load_calendar(conn, year):
+    """Righe del calendario di un anno (4 cifre): per ogni mese, quanti lunedì, martedì, ..."""
+    weekday_ids = {WEEKDAYS[name.strip().lower()[:3]]: day_id
+                   for day_id, name in conn.execute("SELECT id, giorno FROM giorno")
+                   if name.strip().lower()[:3] in WEEKDAYS}
+    rows = []
+    for month in range(1, 13):
+        counts = [0] * 7
+        for week in calendar.monthcalendar(year, month):
+            for weekday, day in enumerate(week):
+                counts[weekday] += day > 0
+        rows += [(year % 100, month, MESI[month - 1], weekday_ids[weekday], counts[weekday], int(weekday >= 5))
+                 for weekday in weekday_ids]
+    conn.execute("DELETE FROM calendario WHERE anno = ?", (year % 100,))
+    conn.executemany("INSERT INTO calendario VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def load_year(conn, year):
+    """Carica un anno (4 cifre) leggendo dal Parquet solo le colonne della tabella incidenti"""
+    data = DatasetCreation.read_dataset(columns=list(DATASET_COLUMNS), years=[year])
+    insert_incidents(conn, prepare_incidents(data))
+    load_calendar(conn, year)
+    conn.execute("INSERT OR REPLACE INTO anni_caricati (anno, caricato_il) VALUES (?, ?)",
+                 (year % 100, datetime.now().isoformat(timespec="seconds")))
+    return len(data)
+
+
+def build_database(db_path=DB_PATH, years=None, dimensions_dir=DIMENSIONS_DIR):
+    """
+    Ricostruisce da zero il database della dashboard.
+    Il database viene scritto in un file temporaneo e sostituito solo a fine build,
+    così la dashboard non legge mai un database a metà.
+    """
+    years = DatasetCreation.dataset_years() if years is None else years
+    if not years:
+        # meglio fermarsi che sostituire il database con uno vuoto
+        raise ValueError("nessun anno da caricare: creare prima il dataset Parquet con DatasetCreation.py")
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # build offline: niente journal né fsync
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        with conn:
+            create_schema(conn)
+            load_dimensions(conn, dimensions_dir)
+            for year in years:
+                print(f"{year}: {load_year(conn, year)} righe")
+        # indici creati dopo il caricamento: molto più veloce che mantenerli riga per riga
+        with conn:
+            create_indexes(conn)
+            create_rollups(conn)
+            create_bitmaps(conn)
+            conn.execute("ANALYZE")
+    except Exception:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+
+
+def append_year(year, db_path=DB_PATH, convert=True):
+    """
+    Aggiunge (o ricarica) un solo anno senza ricostruire il database:
+    converte il file di microdati nella sua partizione Parquet, sostituisce le righe
+    dell'anno in incidenti e ricalcola solo quelle righe dei cubi.
+    Si lavora su una copia poi rinominata, così la dashboard in esecuzione
+    continua a leggere il database precedente finché non vede quello nuovo.
+    """
+    if convert:
+        _, rows, seconds = DatasetCreation.process_year(year)
+        print(f"{year}: {rows} righe convertite in {seconds:.1f}s")
+
+    tmp_path = db_path + ".tmp"
+    shutil.copyfile(db_path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            # i database creati prima di anni_caricati non hanno la tabella
+            conn.executescript(LOADED_YEARS)
+            conn.execute("DELETE FROM incidenti WHERE anno = ?", (year % 100,))
+            print(f"{year}: {load_year(conn, year)} righe")
+            refresh_rollups(conn, year % 100)
+            # le posizioni delle righe cambiano: bitmap ricostruite per intero
+            create_bitmaps(conn)
+            conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+
+
+def export_dimensions(db_path=DB_PATH, dimensions_dir=DIMENSIONS_DIR):
+    """Esporta le tabelle di dimensione di un database esistente in CSV"""
+    os.makedirs(dimensions_dir, exist_ok=True)
+    with sqlite3.connect(db_path) as conn:
+        for table, columns in DIMENSIONS.items():
+            df = pd.read_sql_query(f"SELECT {','.join(columns)} FROM {table}", conn)
+            df.to_csv(os.path.join(dimensions_dir, f"{table}.csv"), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Costruisce dbAccidents.db dal dataset Parquet di DatasetCreation.py")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dimensioni", default=DIMENSIONS_DIR,
+                        help="cartella con regioni.csv, province_regioni.csv, tipo_veicolo.csv")
+    parser.add_argument("--esporta-dimensioni", action="store_true",
+                        help="esporta le tabelle di dimensione dal database esistente ed esce")
+    parser.add_argument("--aggiungi-anno", type=int, metavar="ANNO",
+                        help="converte Dataset/SourceTxtFiles/INCSTRAD_Microdati_<ANNO>.txt e lo aggiunge al database esistente")
+    args = parser.parse_args()
+
+    if args.esporta_dimensioni:
+        export_dimensions(args.db, args.dimensioni)
+    elif args.aggiungi_anno:
+        append_year(args.aggiungi_anno, args.db)
+    else:
+        build_database(args.db, dimensions_dir=args.dimensioni)
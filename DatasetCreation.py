@@ -1,60 +1,199 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-filename = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2022.txt"
-filename2021 = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2021.txt"
-filename2020 = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2020.txt"
-filename2019 = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2019.txt"
-filename2018 = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2018.txt"
-filename2023 = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_2023.txt"
+YEARS = [2018, 2019, 2020, 2021, 2022, 2023]
+SOURCE_PATTERN = "Dataset/SourceTxtFiles/INCSTRAD_Microdati_{year}.txt"
 
+# dataset Parquet partizionato per anno: Dataset/Parquet/anno=<anno>/part-0.parquet
+PARQUET_DIR = "Dataset/Parquet"
+PARTITION_PATTERN = PARQUET_DIR + "/anno={year}"
+
+# righe lette per volta in modalità streaming
+CHUNKSIZE = 50_000
+
+# colonne lette dai microdati ISTAT con il loro tipo
+DTYPES = {
+    "anno": "Int16",
+    "provincia": "Int16",
+    "comune": "Int32",
+    "giorno": "Int8",
+    "mese": "Int8",
+    "localizzazione_incidente": "Int8",
+    "condizioni_meteorologiche": "Int8",
+    "fondo_stradale": "Int8",
+    "natura_incidente": "Int8",
+    "tipo_veicolo_a": "Int8",
+    "veicolo__a___sesso_conducente": "string",
+    "veicolo__a___et__conducente": "string",
+    "tipo_veicoli__b_": "Int8",
+    "veicolo__b___sesso_conducente": "string",
+    "veicolo__b___et__conducente": "string",
+    "morti_entro_24_ore": "Int16",
+    "morti_entro_30_giorni": "Int16",
+    "feriti": "Int16",
+    "Ora": "Int8",
+    "tipo_veicolo__c_": "Int8",
+}
+
+# i campi vuoti nei microdati sono stringhe di soli spazi (di qualsiasi lunghezza):
+# con skipinitialspace diventano "" e quindi NA
+NA_VALUES = [""]
+
+# colonne salvate con dizionario (pochi valori distinti ripetuti su tutte le righe)
+CATEGORICAL = [
+    "provincia",
+    "tipo_veicolo_a",
+    "tipo_veicoli__b_",
+    "veicolo__a___sesso_conducente",
+    "veicolo__a___et__conducente",
+    "veicolo__b___sesso_conducente",
+    "veicolo__b___et__conducente",
+]
+
+ARROW_TYPES = {"Int8": pa.int8(), "Int16": pa.int16(), "Int32": pa.int32(), "string": pa.string()}
 
-def read_file(filename):
-    data = pd.read_csv(filename, delimiter="\t", usecols=["anno", 
-                                                          "provincia", 
-                                                          "comune", 
-                                                          "giorno", 
-                                                          "localizzazione_incidente", 
-                                                          "condizioni_meteorologiche", 
-                                                          "fondo_stradale",
-                                                          "natura_incidente", 
-                                                          "tipo_veicolo_a", 
-                                                          "veicolo__a___sesso_conducente", 
-                                                          "veicolo__a___et__conducente", 
-                                                          "tipo_veicoli__b_", 
-                                                          "veicolo__b___sesso_conducente", 
-                                                          "veicolo__b___et__conducente", 
-                                                          "morti_entro_24_ore", 
-                                                          "morti_entro_30_giorni", 
-                                                          "feriti", 
-                                                          "Ora",
-                                                          "tipo_veicolo__c_"])
-    #sostituisci valori vuoti con null in tutte le colonne
-    data = data.replace(r'^\s*$', pd.NA, regex=True)
 
+def _output_schema():
+    """Schema Arrow dei file Parquet: l'anno non è salvato nel file ma nel nome della partizione"""
+    dtypes = {col: dtype for col, dtype in DTYPES.items()
+              if col not in ("anno", "morti_entro_24_ore", "morti_entro_30_giorni", "tipo_veicolo__c_")}
+    dtypes["morti"] = "Int16"
+    fields = []
+    for col, dtype in dtypes.items():
+        arrow_type = ARROW_TYPES[dtype]
+        if col in CATEGORICAL:
+            arrow_type = pa.dictionary(pa.int16(), arrow_type)
+        fields.append(pa.field(col, arrow_type))
+    return pa.schema(fields)
+
+
+OUTPUT_SCHEMA = _output_schema()
+
+
+def clean(data):
     #rimuovi tutte le righe dove tipo_veicolo_c non è null
     data = data[data["tipo_veicolo__c_"].isnull()]
 
-    data['morti'] = data['morti_entro_24_ore'] + data['morti_entro_30_giorni']
-    
+    data = data.assign(morti=data['morti_entro_24_ore'] + data['morti_entro_30_giorni'])
+
     #rimuovi colonne morti_entro_24_ore e morti_entro_30_giorni
-    data = data.drop(columns=['morti_entro_24_ore', 'morti_entro_30_giorni','tipo_veicolo__c_'])
-    
+    return data.drop(columns=['morti_entro_24_ore', 'morti_entro_30_giorni', 'tipo_veicolo__c_'])
+
+
+def _read_csv(filename, **kwargs):
+    return pd.read_csv(filename, delimiter="\t", usecols=list(DTYPES), dtype=DTYPES,
+                       na_values=NA_VALUES, keep_default_na=False, skipinitialspace=True, **kwargs)
+
+
+def read_file(filename):
+    """Legge e pulisce un intero file di microdati"""
+    return clean(_read_csv(filename))
+
+
+def read_chunks(filename, chunksize=CHUNKSIZE):
+    """Come read_file, ma restituisce il file pulito a blocchi di chunksize righe"""
+    with _read_csv(filename, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield clean(chunk)
+
+
+def to_arrow(chunk):
+    """Blocco pulito -> tabella Arrow con lo schema del dataset"""
+    chunk = chunk[OUTPUT_SCHEMA.names].astype({col: "category" for col in CATEGORICAL})
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    return table.cast(OUTPUT_SCHEMA.with_metadata(table.schema.metadata))
+
+
+def convert_file(filename, output, chunksize=CHUNKSIZE):
+    """
+    Converte un file di microdati in un file Parquet in streaming:
+    in memoria c'è al più un blocco alla volta, scritto come row group.
+    """
+    rows = 0
+    with pq.ParquetWriter(output, OUTPUT_SCHEMA) as writer:
+        for chunk in read_chunks(filename, chunksize):
+            writer.write_table(to_arrow(chunk))
+            rows += len(chunk)
+    return rows
+
+
+def dataset_years():
+    """Anni presenti nel dataset Parquet (solo le partizioni con il file dei dati)"""
+    if not os.path.isdir(PARQUET_DIR):
+        return []
+    return sorted(int(name.split("=")[1]) for name in os.listdir(PARQUET_DIR)
+                  if name.startswith("anno=") and os.path.isfile(os.path.join(PARQUET_DIR, name, "part-0.parquet")))
+
+
+def read_dataset(columns=None, years=None):
+    """
+    Legge il dataset Parquet leggendo solo le colonne richieste
+    e solo le partizioni degli anni richiesti (anni a 4 cifre).
+    """
+    filters = [("anno", "in", list(years))] if years is not None else None
+    data = pd.read_parquet(PARQUET_DIR, columns=columns, filters=filters, dtype_backend="numpy_nullable")
+    if "anno" in data.columns:
+        data["anno"] = data["anno"].astype("int16")
+    for col in data.columns.intersection(CATEGORICAL):
+        data[col] = data[col].astype("category")
     return data
 
-data2022 = read_file(filename)
-data2022.to_csv("Dataset/INCSTRAD_Microdati_2022.csv", index=False)
 
-data2021 = read_file(filename2021)
-data2021.to_csv("Dataset/INCSTRAD_Microdati_2021.csv", index=False)
+def process_year(year, chunksize=CHUNKSIZE):
+    """
+    Elabora un anno scrivendo su un file temporaneo poi rinominato:
+    la partizione è sempre completa oppure assente.
+    Returns: (year, rows, seconds)
+    """
+    start = time.perf_counter()
+    partition = PARTITION_PATTERN.format(year=year)
+    output = os.path.join(partition, "part-0.parquet")
+    # file temporaneo fuori dalla partizione, che viene creata solo a conversione riuscita;
+    # i file che iniziano con "." vengono ignorati da chi legge il dataset
+    os.makedirs(PARQUET_DIR, exist_ok=True)
+    tmp_output = os.path.join(PARQUET_DIR, f".anno={year}.part-0.parquet.tmp")
+    try:
+        rows = convert_file(SOURCE_PATTERN.format(year=year), tmp_output, chunksize)
+        os.makedirs(partition, exist_ok=True)
+        os.replace(tmp_output, output)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    return year, rows, time.perf_counter() - start
+
 
-data2020 = read_file(filename2020)
-data2020.to_csv("Dataset/INCSTRAD_Microdati_2020.csv", index=False)
+def main():
+    parser = argparse.ArgumentParser(description="Converte i microdati ISTAT nel dataset Parquet, un processo per anno")
+    parser.add_argument("--anni", type=int, nargs="+", default=YEARS)
+    parser.add_argument("--processi", type=int, default=None,
+                        help="numero di processi (default: numero di core)")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
 
-data2019 = read_file(filename2019)
-data2019.to_csv("Dataset/INCSTRAD_Microdati_2019.csv", index=False)
+    start = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.processi) as pool:
+        futures = {pool.submit(process_year, year, args.chunksize): year for year in args.anni}
+        for future in as_completed(futures):
+            # un anno che fallisce (es. file mancante) non ferma gli altri
+            try:
+                year, rows, seconds = future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"{futures[future]}: errore {type(e).__name__}: {e}")
+                continue
+            print(f"{year}: {rows} righe in {seconds:.1f}s")
+    print(f"Totale: {time.perf_counter() - start:.1f}s")
+    if failed:
+        sys.exit(f"Anni non convertiti: {', '.join(map(str, sorted(failed)))}")
 
-data2018 = read_file(filename2018)
-data2018.to_csv("Dataset/INCSTRAD_Microdati_2018.csv", index=False)
 
-data2023 = read_file(filename2023)
-data2023.to_csv("Dataset/INCSTRAD_Microdati_2023.csv", index=False)
+if __name__ == "__main__":
+    main()
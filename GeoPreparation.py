@@ -0,0 +1,198 @@
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+GEO_DIR = "Geo"
+# servita da Streamlit come file statici (server.enableStaticServing) in /app/static/geo
+SIMPLIFIED_DIR = "static/geo"
+SOURCES = ["limits_IT_regions.geojson", "limits_IT_provinces.geojson"]
+
+# tolleranze di semplificazione in gradi, dalla più fine alla più grossolana
+TOLERANCES = [0.001, 0.005, 0.02]
+
+
+def simplified_path(filename, tolerance):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(SIMPLIFIED_DIR, f"{name}_{tolerance:g}.geojson")
+
+
+def degrees_per_pixel(zoom, tile_size=512):
+    """Ampiezza in gradi (longitudine) di un pixel della mappa a un dato livello di zoom"""
+    return 360 / (tile_size * 2 ** zoom)
+
+
+def path_for_zoom(filename, zoom):
+    """
+    GeoJSON più leggero che a questo zoom non perde dettagli visibili:
+    la tolleranza più grossolana sotto la dimensione di un pixel.
+    Se i file semplificati non esistono si usa l'originale.
+    """
+    pixel = degrees_per_pixel(zoom)
+    for tolerance in sorted(TOLERANCES, reverse=True):
+        path = simplified_path(filename, tolerance)
+        if tolerance <= pixel and os.path.exists(path):
+            return path
+    return filename
+
+
+# =========================
+# DOUGLAS-PEUCKER
+# =========================
+
+def _segment_distances(points, a, b):
+    """Distanza di ogni punto dal segmento a-b"""
+    ab = b - a
+    length2 = ab @ ab
+    if length2 == 0:
+        return np.hypot(*(points - a).T)
+    t = np.clip((points - a) @ ab / length2, 0, 1)
+    return np.hypot(*(points - (a + t[:, None] * ab)).T)
+
+
+def douglas_peucker(points, tolerance):
+    """Semplifica una polilinea mantenendo primo e ultimo punto"""
+    points = np.asarray(points, dtype=float)
+    if len(points) <= 2:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(points[start + 1:end], points[start], points[end])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            stack += [(start, i), (i, end)]
+    return points[keep]
+
+
+# =========================
+# SEMPLIFICAZIONE PER ARCHI
+# =========================
+# I confini fra due regioni compaiono in entrambi i poligoni. Spezzando gli anelli
+# negli archi condivisi e semplificando ogni arco una sola volta, i due lati del
+# confine restano identici: niente buchi né sovrapposizioni fra aree vicine.
+
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return [ring for ring in geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    return []
+
+
+def _point_owners(features):
+    """Punto -> insieme degli anelli che lo contengono"""
+    owners = {}
+    ring_id = 0
+    for feature in features:
+        for ring in _rings(feature["geometry"]):
+            for point in ring[:-1]:
+                owners.setdefault(tuple(point), set()).add(ring_id)
+            ring_id += 1
+    return owners
+
+
+def _simplify_arc(arc, tolerance, arcs_cache):
+    """Semplifica un arco; lo stesso arco percorso al contrario dà lo stesso risultato"""
+    key = tuple(arc)
+    reversed_key = key[::-1]
+    canonical = min(key, reversed_key)
+    if canonical not in arcs_cache:
+        arcs_cache[canonical] = [tuple(p) for p in douglas_peucker(canonical, tolerance)]
+    simplified = arcs_cache[canonical]
+    return simplified if key == canonical else simplified[::-1]
+
+
+def _simplify_ring(ring, owners, tolerance, arcs_cache):
+    points = [tuple(p) for p in ring[:-1]]
+    n = len(points)
+    if n < 4:
+        return ring
+
+    # punti di giunzione: dove cambia l'insieme degli anelli che condividono il confine
+    breaks = [i for i in range(n)
+              if owners[points[i]] != owners[points[i - 1]] or owners[points[i]] != owners[points[(i + 1) % n]]]
+    if not breaks:
+        # anello isolato: spezzato nel primo punto e nel punto più lontano da esso
+        far = int(np.argmax(np.hypot(*(np.asarray(points) - points[0]).T)))
+        breaks = [0, far] if far > 0 else [0]
+
+    result = []
+    for j, start in enumerate(breaks):
+        end = breaks[(j + 1) % len(breaks)]
+        arc = points[start:end + 1] if end > start else points[start:] + points[:end + 1]
+        result += _simplify_arc(arc, tolerance, arcs_cache)[:-1]
+
+    # un anello deve restare un poligono valido
+    if len(result) < 3:
+        return ring
+    return [list(p) for p in result] + [list(result[0])]
+
+
+def _quantize(ring, decimals):
+    """Arrotonda le coordinate e toglie i punti consecutivi diventati uguali"""
+    out = []
+    for x, y in ring:
+        point = [round(x, decimals), round(y, decimals)]
+        if not out or point != out[-1]:
+            out.append(point)
+    return out if len(out) >= 4 else ring
+
+
+def simplify_geojson(data, tolerance):
+    """Copia semplificata e quantizzata di una FeatureCollection di poligoni"""
+    features = data["features"]
+    owners = _point_owners(features)
+    arcs_cache = {}
+    # griglia di quantizzazione 10 volte più fine della tolleranza
+    decimals = max(0, math.ceil(-math.log10(tolerance)) + 1)
+
+    def simplify(rings):
+        return [_quantize(_simplify_ring(ring, owners, tolerance, arcs_cache), decimals) for ring in rings]
+
+    out_features = []
+    for feature in features:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coordinates = simplify(geometry["coordinates"])
+        elif geometry["type"] == "MultiPolygon":
+            coordinates = [simplify(polygon) for polygon in geometry["coordinates"]]
+        else:
+            coordinates = geometry["coordinates"]
+        out_features.append({
+            "type": "Feature",
+            "properties": feature["properties"],
+            "geometry": {"type": geometry["type"], "coordinates": coordinates},
+        })
+    return {"type": "FeatureCollection", "features": out_features}
+
+
+def prepare(filename, tolerances=TOLERANCES):
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    os.makedirs(SIMPLIFIED_DIR, exist_ok=True)
+    for tolerance in tolerances:
+        output = simplified_path(filename, tolerance)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(simplify_geojson(data, tolerance), f, separators=(",", ":"))
+        print(f"{output}: {os.path.getsize(output) / 1024:.0f} KB (originale {os.path.getsize(filename) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera versioni semplificate dei GeoJSON delle mappe")
+    parser.add_argument("files", nargs="*", default=[os.path.join(GEO_DIR, name) for name in SOURCES])
+    args = parser.parse_args()
+
+    for filename in args.files:
+        if os.path.exists(filename):
+            prepare(filename)
+        else:
+            print(f"{filename}: non trovato")
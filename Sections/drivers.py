@@ -1,73 +1,66 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from Utils import utils
+from Utils import utils, store, cache, crossfilter, prefetch
 
 
 # =========================
 # CACHE
 # =========================
 
-@st.cache_data(ttl=3600)
-def load_sesso_conducenti():
-    """
-    Esegue la query per la distribuzione per sesso dei conducenti
-    (A + B dove il veicolo B è presente).
-    """
-    query = """
-    SELECT Sesso, COUNT(*) AS conteggio
-    FROM (
-        SELECT SessoConducenteA AS Sesso
-        FROM incidenti
-        UNION ALL
-        SELECT SessoConducenteB AS Sesso
-        FROM incidenti
-        WHERE idTipoVeicoloB <> '' 
-          AND idTipoVeicoloB IS NOT NULL
-    ) AS T1
-    GROUP BY Sesso;
-    """
-    df = utils.run_query(query)
-
-    # Normalizza eventuali valori vuoti / null
-    if "Sesso" in df.columns:
-        df["Sesso"] = (
-            df["Sesso"]
-            .fillna("Non dichiarato")
-            .replace({"": "Non dichiarato"})
-        )
+# codici del cubo conducenti (DatabaseCreation.ROLLUPS["cubo_conducenti"])
+SESSI = ["Non dichiarato", "M", "F"]   # idSesso
+RUOLI = ["A", "B"]
 
-    # Ordina per conteggio desc
-    if "conteggio" in df.columns:
-        df = df.sort_values("conteggio", ascending=False).reset_index(drop=True)
 
-    return df
-
-
-@st.cache_data(ttl=3600)
-def load_eta_conducenti():
+@cache.cached
+def load_drivers_cube(years: tuple, filters: tuple = ()):
+    """
+    Conducenti come array anni × ruolo × fascia d'età × sesso (years da utils.normalize_years);
+    fascia e sesso 0 = non indicato.
     """
-    Esegue la query per la distribuzione per età e sesso dei conducenti
-    (A + B dove il veicolo B è presente).
+    df = crossfilter.cube("conducenti", years, filters)
+    n_bands = int(store.cube("fasce_eta")["idFascia"].max()) + 1
+    shape = (len(years), len(RUOLI), n_bands, len(SESSI))
+    flat = np.ravel_multi_index((
+        pd.Index(years).get_indexer(df["anno"]),
+        pd.Index(RUOLI).get_indexer(df["ruolo"].astype(str)),
+        df["idFascia"].to_numpy(dtype=np.int64),
+        df["idSesso"].to_numpy(dtype=np.int64),
+    ), shape)
+    return np.bincount(flat, weights=df["conducenti"].to_numpy(dtype=float),
+                       minlength=int(np.prod(shape))).reshape(shape).astype(np.int64)
+
+
+@cache.cached
+def load_sesso_conducenti(years: tuple, filters: tuple = ()):
+    """Distribuzione per sesso dei conducenti (A + B dove il veicolo B è presente)."""
+    counts = load_drivers_cube(years, filters).sum(axis=(0, 1, 2))
+    df = pd.DataFrame({"Sesso": SESSI, "conteggio": counts})
+    return (df[df["conteggio"] > 0]
+            .sort_values("conteggio", ascending=False)
+            .reset_index(drop=True))
+
+
+@cache.cached
+def load_eta_conducenti(years: tuple, filters: tuple = ()):
     """
-    query = """
-    SELECT Eta, Sesso, COUNT(*) as Totale
-    FROM (
-        SELECT EtaConducenteA as Eta, SessoConducenteA as Sesso
-        FROM incidenti
-        UNION ALL
-        SELECT EtaConducenteB as Eta, SessoConducenteB as Sesso
-        FROM incidenti
-        WHERE idTipoVeicoloB <> ''
-        AND idTipoVeicoloB IS NOT NULL
-    ) as T1
-    WHERE Sesso <> '' AND Eta <> '' AND Eta NOT LIKE '%n.i%'
-    GROUP BY Eta, Sesso
-    ORDER BY Eta;
+    Distribuzione per età e sesso dei conducenti (A + B dove il veicolo B è presente),
+    senza fascia o sesso non indicati. Una riga per fascia (in ordine) e sesso.
     """
-    df = utils.run_query(query)
-    return df
+    counts = load_drivers_cube(years, filters).sum(axis=(0, 1))
+    bands = store.cube("fasce_eta").sort_values("idFascia")
+    ids = bands["idFascia"].to_numpy(dtype=np.int64)
+    df = pd.DataFrame({
+        "idFascia": np.repeat(ids, 2),
+        "Eta": np.repeat(bands["fascia"].astype(str).to_numpy(), 2),
+        "minorenne": np.repeat(bands["minorenne"].astype(bool).to_numpy(), 2),
+        "Sesso": np.tile(SESSI[1:], len(ids)),
+        "Totale": counts[ids][:, 1:].ravel(),
+    })
+    return df[df["Totale"] > 0].reset_index(drop=True)
 
 
 # =========================
@@ -127,12 +120,9 @@ def render_age_bar(df: pd.DataFrame):
 
     # Aggrega minorenni
     df_processed = df.copy()
-    fasce_minorenni = ["0-5  ", "6-9  ", "10-14", "15-17"]
-    df_processed.loc[df_processed["Eta"].isin(fasce_minorenni), "Eta"] = "0-17"
-
-    eta_order = ["0-17", "18-29", "30-44", "45-54", "55-64", "65+  "]
-    df_processed = df_processed[df_processed["Eta"].isin(eta_order)]
+    df_processed.loc[df_processed["minorenne"], "Eta"] = "0-17"
 
+    eta_order = list(dict.fromkeys(df_processed["Eta"]))
     df_pivot = df_processed.groupby(["Eta", "Sesso"], as_index=False)["Totale"].sum()
     df_pivot["Eta"] = pd.Categorical(df_pivot["Eta"], categories=eta_order, ordered=True)
     df_pivot = df_pivot.sort_values("Eta")
@@ -184,17 +174,13 @@ def render_minors_pie(df: pd.DataFrame):
         st.info("Nessun dato disponibile.")
         return
 
-    classi_minori = ["0-5  ", "6-9  ", "10-14", "15-17"]
-    df_min = (df[df["Eta"].isin(classi_minori)]
-              .groupby("Eta", as_index=False)["Totale"].sum())
+    # righe già in ordine di fascia
+    df_min = (df[df["minorenne"]]
+              .groupby("Eta", as_index=False, sort=False)["Totale"].sum())
     if df_min.empty:
         st.info("Nessun dato disponibile per la fascia 0–17.")
         return
 
-    # Ordine coerente
-    df_min["Eta"] = pd.Categorical(df_min["Eta"], categories=classi_minori, ordered=True)
-    df_min = df_min.sort_values("Eta").reset_index(drop=True)
-
     # Palette kids
     colors = [
         "#F155CF",  
@@ -205,7 +191,7 @@ def render_minors_pie(df: pd.DataFrame):
 
 
     fig = go.Figure(data=[go.Pie(
-        labels=df_min["Eta"].astype(str).str.strip() + " anni",
+        labels=df_min["Eta"] + " anni",
         values=df_min["Totale"],
         hole=0.45,
         marker=dict(colors=colors, line=dict(color='white', width=2)),
@@ -235,25 +221,41 @@ def render_minors_pie(df: pd.DataFrame):
 # MAIN: SHOW
 # =========================
 
+def prefetch_tasks(filters):
+    """Chiamate che show() farà con lo stato attuale dei widget (per Utils/prefetch.py)"""
+    years = utils.selected_years()
+    return [(load_sesso_conducenti, (years, filters)), (load_eta_conducenti, (years, filters))]
+
+
 def show():
     """Entry point usato da main.py -> drivers.show()"""
     st.markdown('<div class="section-header">Profilo conducenti coinvolti</div>', unsafe_allow_html=True)
+
+    # Periodo dal filtro della sidebar: il cubo viene solo ritagliato in memoria
+    years = utils.selected_years()
+    if len(years) > 1:
+        subtitle = f"Totale dal {2000 + years[0]} al {2000 + years[-1]}"
+    else:
+        subtitle = f"Anno {2000 + years[0]}" if years else ""
+
     st.markdown(
         "<div class='section-subtitle'>"
-        "Totale dal 2019 al 2023"
+        f"{subtitle}"
         "</div>",
         unsafe_allow_html=True
     )
+    filters = crossfilter.current()
+    crossfilter.show_active("conducenti", filters)
 
     # Layout a 2 colonne
     col1, col2 = st.columns(2)
     
     with col1:
-        df_sesso = load_sesso_conducenti()
+        df_sesso = prefetch.result(load_sesso_conducenti, years, filters)
         render_pie(df_sesso)
     
     with col2:
-        df_eta = load_eta_conducenti()
+        df_eta = prefetch.result(load_eta_conducenti, years, filters)
         render_age_bar(df_eta)
 
     # --- dettaglio minorenni 0–17 ---
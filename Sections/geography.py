@@ -1,92 +1,134 @@
 import streamlit as st
 import pandas as pd
 import json
-from Utils import utils
+from Utils import utils, store, cache, crossfilter, prefetch
 import plotly.graph_objects as go
+import GeoPreparation
 
 # ==========================
 # CACHE DI BASE
 # ==========================
 
-@st.cache_data
+@cache.cached
 def load_geojson(filepath: str):
     """Carica il GeoJSON una sola volta."""
     with open(filepath, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-@st.cache_data(ttl=600)
-def get_province_data(region_id, years_str, num_years):
-    """Province di una singola regione (per il grafico laterale)."""
-    query = f"""
-    SELECT pr.provincia, pr.popolazione, COUNT(*) AS incidenti
-    FROM incidenti i
-    JOIN province_regioni pr ON i.idProvincia = pr.idProvincia
-    WHERE i.anno IN ({years_str}) AND pr.idRegione = {int(region_id)}
-    GROUP BY pr.provincia, pr.popolazione
-    ORDER BY COUNT(*) DESC
+# vista -> (file GeoJSON, chiave della feature, colonna id, colonna nome)
+GEO_VIEWS = {
+    "Province": ("Geo/limits_IT_provinces.geojson", "prov_istat_code_num", "idProvincia", "provincia"),
+    "Regioni": ("Geo/limits_IT_regions.geojson", "reg_istat_code", "idRegione", "nome_regione"),
+}
+
+MAP_ZOOM = 4.8
+
+
+def geojson_path(view_mode: str):
+    """GeoJSON semplificato (GeoPreparation.py) più leggero adatto allo zoom della mappa"""
+    return GeoPreparation.path_for_zoom(GEO_VIEWS[view_mode][0], MAP_ZOOM)
+
+
+def geojson_source(view_mode: str):
+    """
+    Geometria da passare alla mappa. Se il file è servito come statico si passa
+    il suo URL: il browser lo scarica una volta e lo tiene in cache, e ai rerun la
+    figura contiene solo locations/z/customdata. Altrimenti il GeoJSON completo.
     """
-    return utils.run_query(query)
+    path = geojson_path(view_mode)
+    if path.startswith("static/") and st.get_option("server.enableStaticServing"):
+        base_url = st.get_option("server.baseUrlPath").strip("/")
+        prefix = f"/{base_url}" if base_url else ""
+        return f"{prefix}/app/{path}"
+    return load_geojson(path)
+
 
+@cache.cached
+def get_geo_frame(view_mode: str, years: tuple, filters: tuple = ()):
+    """Incidenti per regione/provincia; years è una tupla di utils.normalize_years, filters di crossfilter.current."""
+    num_years = len(years)
+    df_cube = crossfilter.cube("province", years, filters)
 
-@st.cache_data(ttl=600)
-def get_geo_data(view_mode: str, years_str: str, num_years: int):
-    """Calcola i dati geografici (regioni/province)."""
     if view_mode == "Province":
-        query_province = f"""
-        SELECT pr.idProvincia, pr.provincia, pr.popolazione, COUNT(*) AS incidenti
-        FROM incidenti i
-        JOIN province_regioni pr ON i.idProvincia = pr.idProvincia
-        WHERE i.anno IN ({years_str})
-        GROUP BY pr.idProvincia, pr.provincia, pr.popolazione
-        """
-        df_geo = utils.run_query(query_province)
+        df_geo = (df_cube.groupby(["idProvincia", "provincia", "popolazione", "idRegione"], observed=True, as_index=False)["incidenti"].sum()
+                         .astype({"provincia": str}))
         df_geo["idProvincia"] = df_geo["idProvincia"].astype(int)
+        df_geo["idRegione"] = df_geo["idRegione"].astype(int)
         
         if num_years > 1:
             df_geo['incidenti'] = df_geo['incidenti'] / num_years
         
         df_geo["incidenti_per_100k"] = df_geo["incidenti"] / df_geo["popolazione"] * 100_000
         
-        geojson_data = load_geojson("Geo/limits_IT_provinces.geojson")
-        location_key = 'prov_istat_code_num'
-        id_col = 'idProvincia'
-        name_col = 'provincia'
-        
     else:
-        query_regioni = f"""
-        SELECT pr.idRegione, pr.regione AS nome_regione, COUNT(*) AS incidenti
-        FROM incidenti i
-        JOIN province_regioni pr ON i.idProvincia = pr.idProvincia
-        WHERE i.anno IN ({years_str})
-        GROUP BY pr.idRegione, pr.regione
-        """
-        df_regioni = utils.run_query(query_regioni)
+        df_regioni = (df_cube.groupby(["idRegione", "regione"], observed=True, as_index=False)["incidenti"].sum()
+                             .rename(columns={"regione": "nome_regione"})
+                             .astype({"nome_regione": str}))
         df_regioni["idRegione"] = df_regioni["idRegione"].astype(str).str.zfill(2)
         
         if num_years > 1:
             df_regioni['incidenti'] = df_regioni['incidenti'] / num_years
         
-        query_pop = "SELECT id AS idRegione, popolazione FROM regioni"
-        df_pop = utils.run_query(query_pop)
+        df_pop = store.cube("regioni")[["idRegione", "popolazione"]].copy()
         df_pop["idRegione"] = df_pop["idRegione"].astype(str).str.zfill(2)
         
         df_geo = df_regioni.merge(df_pop, on="idRegione", how="left")
         df_geo["incidenti_per_100k"] = df_geo["incidenti"] / df_geo["popolazione"] * 100_000
-        
-        geojson_data = load_geojson("Geo/limits_IT_regions.geojson")
-        location_key = 'reg_istat_code'
-        id_col = 'idRegione'
-        name_col = 'nome_regione'
     
+    return df_geo
+
+
+@cache.cached
+def get_region_province_index(years: tuple, filters: tuple = ()):
+    """
+    idRegione -> province della regione, ricavato dall'aggregato per provincia
+    (lo stesso della mappa Province): il click su una regione non ricalcola nulla.
+    """
+    df_province = get_geo_frame("Province", years, filters)
+    columns = ["provincia", "popolazione", "incidenti"]
+    return {
+        int(region_id): df[columns].sort_values("incidenti", ascending=False).reset_index(drop=True)
+        for region_id, df in df_province.groupby("idRegione")
+    }
+
+
+def get_province_data(region_id: int, years: tuple, filters: tuple = ()):
+    """Province di una singola regione (per il grafico laterale), incidenti già mediati sugli anni."""
+    index = prefetch.result(get_region_province_index, years, filters)
+    if region_id not in index:
+        return pd.DataFrame(columns=["provincia", "popolazione", "incidenti"])
+    return index[region_id].copy()
+
+
+def get_geo_data(view_mode: str, years: tuple, filters: tuple = ()):
+    """
+    Calcola i dati geografici (regioni/province).
+    La geometria (URL o GeoJSON in cache) non dipende dal periodo.
+    """
+    _, location_key, id_col, name_col = GEO_VIEWS[view_mode]
+    df_geo = prefetch.result(get_geo_frame, view_mode, years, filters)
+    geojson_data = geojson_source(view_mode)
     return df_geo, geojson_data, location_key, id_col, name_col
 
 
+def prefetch_tasks(filters):
+    """Chiamate che show() farà con lo stato attuale dei widget (per Utils/prefetch.py)"""
+    years = utils.selected_years()
+    view_mode = st.session_state.get("geo_view_mode", "Regioni")
+    tasks = [(get_geo_frame, (view_mode, years, filters))]
+    if view_mode == "Regioni" and st.session_state.get("selected_region"):
+        tasks.append((get_region_province_index, (years, filters)))
+    return tasks
+
+
 def show():
     if "map_version" not in st.session_state:
         st.session_state.map_version = 0
 
     st.markdown('<div class="section-header">Distribuzione Geografica</div>', unsafe_allow_html=True)
+    filters = crossfilter.current()
+    crossfilter.show_active("province", filters)
 
     col_chart, col_filters = st.columns([2, 1])
 
@@ -95,40 +137,25 @@ def show():
     # ==========================
     with col_filters:
         st.markdown("<br>", unsafe_allow_html=True)
-        available_years = utils.available_years
-        year_options = ["Media di tutti gli anni"] + [2000 + year for year in sorted(available_years, reverse=True)]
-        year_selection_geo = st.selectbox(
-            "Seleziona Periodo",
-            options=year_options,
-            index=0,
-            help="Scegli un anno specifico o tutti gli anni per la media"
-        )
-
-        view_mode = st.radio("Visualizza per:", ["Regioni", "Province"])
+        view_mode = st.radio("Visualizza per:", ["Regioni", "Province"], key="geo_view_mode")
         assoluti = st.toggle("Valori assoluti", value=False)
 
     # ==========================
-    # SCELTA ANNI
+    # PERIODO (filtro della sidebar)
     # ==========================
-    if year_selection_geo == "Media di tutti gli anni":
-        selected_years_geo = available_years
-        num_years = len(available_years)
-        display_text_geo = "Media 2019-2023"
+    years = utils.selected_years()
+    if len(years) > 1:
+        display_text_geo = f"Media {2000 + years[0]}-{2000 + years[-1]}"
     else:
-        year_value = year_selection_geo - 2000
-        selected_years_geo = [year_value]
-        num_years = 1
-        display_text_geo = str(year_selection_geo)
-
-    years_str = ','.join(map(str, selected_years_geo))
+        display_text_geo = str(2000 + years[0]) if years else ""
 
     # ==========================
     # DATI GEO (CACHE)
     # ==========================
     df_geo, geojson_data, location_key, id_col, name_col = get_geo_data(
         view_mode=view_mode,
-        years_str=years_str,
-        num_years=num_years
+        years=years,
+        filters=filters
     )
 
     # Scegli la metrica da visualizzare
@@ -175,7 +202,7 @@ def show():
 
     fig_map.update_layout(
         mapbox_style="carto-positron",
-        mapbox_zoom=4.8,
+        mapbox_zoom=MAP_ZOOM,
         mapbox_center={"lat": 42.5, "lon": 12.5},
         margin={"r": 0, "t": 30, "l": 0, "b": 0},
         height=700,
@@ -196,7 +223,7 @@ def show():
     # RENDER MAPPA + CLICK
     # ==========================
     with col_chart:
-        map_key = f"map_{year_selection_geo}_{assoluti}_{st.session_state.map_version}"
+        map_key = f"map_{'_'.join(map(str, years))}_{assoluti}_{st.session_state.map_version}"
 
         if view_mode == "Regioni":
             st.markdown(
@@ -217,7 +244,7 @@ def show():
             map_click = st.plotly_chart(
                 fig_map, 
                 use_container_width=True, 
-                key=map_key, #f"map_{year_selection_geo}_{assoluti}",
+                key=map_key,
                 on_select="rerun",
                 selection_mode="points"
             )
@@ -229,13 +256,13 @@ def show():
                 
                 if region_code and st.session_state.get('selected_region') != region_code:
                     st.session_state.selected_region = region_code
-                    st.rerun()
+                    utils.rerun_section()
         else:
             # Province: solo visualizzazione
             st.plotly_chart(
                 fig_map, 
                 use_container_width=True,
-                key=map_key #f"map_{year_selection_geo}_{assoluti}"
+                key=map_key
             )
 
     # ==========================
@@ -245,23 +272,30 @@ def show():
         with col_filters:
             if 'selected_region' in st.session_state:   
                 # Reset button
+                region_id = int(st.session_state.selected_region)
                 if st.button("Deseleziona regione", use_container_width=True):
+                    if st.session_state.get("cf_regione") == region_id:
+                        # la regione filtra anche le altre sezioni: si toglie il filtro ovunque
+                        crossfilter.set_region(None)
+                        st.rerun()
                     if "selected_region" in st.session_state:
                         del st.session_state.selected_region
                     st.session_state.map_version += 1  
-                    st.rerun()
+                    utils.rerun_section()
+
+                # il click resta locale alla mappa; le altre sezioni si filtrano solo su richiesta
+                if st.session_state.get("cf_regione") != region_id:
+                    if st.button("Filtra le altre sezioni", use_container_width=True):
+                        crossfilter.set_region(region_id)
+                        st.rerun()
 
                 df_province_region = get_province_data(
-                    st.session_state.selected_region,
-                    years_str,
-                    num_years
+                    region_id,
+                    years,
+                    filters
                 )
 
                 if not df_province_region.empty:
-                    # media su più anni 
-                    if num_years > 1:
-                        df_province_region['incidenti'] = df_province_region['incidenti'] / num_years
-
                     # calcolo per 100k
                     df_province_region['incidenti_100k'] = (
                         df_province_region['incidenti'] / df_province_region['popolazione']
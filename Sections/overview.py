@@ -1,4 +1,4 @@
-from Utils import utils
+from Utils import utils, store
 import streamlit as st
 import plotly.graph_objects as go
 import pandas as pd
@@ -134,16 +134,10 @@ def show():
         })
 
     with col_geo:
-        # Query per ottenere incidenti per area geografica
-        query_geo = """
-        SELECT r.Area, COUNT(*) AS incidenti
-        FROM incidenti i
-        JOIN province_regioni pr ON i.idProvincia = pr.idProvincia
-        JOIN regioni r ON pr.idRegione = r.id
-        GROUP BY r.Area
-        ORDER BY r.Area
-        """
-        df_geo = utils.run_query(query_geo)
+        # Incidenti per area geografica
+        df_geo = (store.cube("province")
+                  .groupby("Area", observed=True, as_index=False)["incidenti"].sum()
+                  .astype({"Area": str}))
         
         # Pulisci eventuali spazi bianchi e normalizza "Sud" in "Sud e isole"
         df_geo['Area'] = df_geo['Area'].str.strip()
@@ -1,44 +1,49 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from Utils import utils
-import sqlite3
+from Utils import utils, store, cache, crossfilter, prefetch
 import plotly.graph_objects as go
 
 # =========================
 # CACHE PER VELOCIZZARE
 # =========================
 
-@st.cache_data(ttl=3600)
-def load_all_temporal_data(years_str):
-    """Carica tutti i dati temporali in una volta sola - CACHED"""
-    conn = sqlite3.connect("dbAccidents.db")
-    
-    # Query numero incidenti giorno settimana
-    query_day = f"""
-    SELECT g.giorno, g.id as day_id, COUNT(*) AS numero_incidenti,
-            SUM(i.Morti) as morti_totali
-    FROM incidenti i
-    JOIN giorno g ON i.idGiorno = g.id
-    WHERE i.anno IN ({years_str})
-    GROUP BY g.giorno, g.id
-    ORDER BY g.id;
+# ore 0-23 più una posizione per l'ora non indicata, che conta solo nei totali
+HOURS = 24
+
+@cache.cached
+def load_temporal_cube(years: tuple, filters: tuple = ()):
     """
-    df_day = pd.read_sql_query(query_day, conn)
-    
-    # Query per dettaglio del giorno
-    query_hour_all = f"""
-    SELECT g.id as day_id, i.Ora, COUNT(*) AS numero_incidenti,
-            SUM(i.Morti) as morti_totali
-    FROM incidenti i
-    JOIN giorno g ON i.idGiorno = g.id
-    WHERE i.anno IN ({years_str})
-    GROUP BY g.id, i.Ora
-    ORDER BY g.id, i.Ora;
+    Cubo anni × giorni × ore (years da utils.normalize_years), calcolato una volta
+    sola: totali giornalieri, profili orari e massimi degli assi sono riduzioni sugli array.
     """
-    df_hour_all = pd.read_sql_query(query_hour_all, conn)
-    
-    conn.close()
-    return df_day, df_hour_all
+    df = crossfilter.cube("giorno_ora", years, filters)
+    df = df[df["giorno"].notna()]
+
+    days = (df[["day_id", "giorno"]].drop_duplicates("day_id")
+              .astype({"day_id": int, "giorno": str})
+              .sort_values("day_id")
+              .reset_index(drop=True))
+    year_idx = pd.Index(years).get_indexer(df["anno"])
+    day_idx = pd.Index(days["day_id"]).get_indexer(df["day_id"])
+    hours = pd.to_numeric(df["Ora"]).to_numpy(dtype=float, na_value=HOURS)
+    hour_idx = np.where((hours >= 0) & (hours < HOURS), hours, HOURS).astype(int)
+
+    shape = (len(years), len(days), HOURS + 1)
+    flat = np.ravel_multi_index((year_idx, day_idx, hour_idx), shape)
+    size = int(np.prod(shape))
+    return {
+        "days": days,
+        "incidenti": np.bincount(flat, weights=df["incidenti"].to_numpy(dtype=float), minlength=size).reshape(shape),
+        "morti": np.bincount(flat, weights=df["morti"].to_numpy(dtype=float), minlength=size).reshape(shape),
+    }
+
+def day_totals(cube):
+    """Incidenti e morti per giorno della settimana, sommati su anni e ore"""
+    df_day = cube["days"].copy()
+    df_day["numero_incidenti"] = cube["incidenti"].sum(axis=(0, 2))
+    df_day["morti_totali"] = cube["morti"].sum(axis=(0, 2))
+    return df_day[["giorno", "day_id", "numero_incidenti", "morti_totali"]]
 
 def process_day_data(df_day, num_years):
     """Processa i dati giornalieri"""
@@ -54,65 +59,150 @@ def process_day_data(df_day, num_years):
     
     return df_day
 
-def process_hour_data(df_hour_all, selected_day_id, num_years, is_average):
-    """Processa i dati orari filtrati in memoria"""
-    if selected_day_id:
-        # Dati di un singolo giorno
-        df_hour = df_hour_all[df_hour_all['day_id'] == selected_day_id].copy()
-        df_hour = df_hour.groupby('Ora').agg({
-            'numero_incidenti': 'sum',
-            'morti_totali': 'sum'
-        }).reset_index()
-    else:
-        # Media settimanale: somma tutti i giorni e dividi per 7
-        df_hour = df_hour_all.groupby('Ora').agg({
-            'numero_incidenti': 'sum',
-            'morti_totali': 'sum'
-        }).reset_index()
-        # Dividi per 7 giorni per ottenere la media
-        df_hour['numero_incidenti'] = df_hour['numero_incidenti'] / 7
-        df_hour['morti_totali'] = df_hour['morti_totali'] / 7
-    
-    # Riempi ore mancanti
-    df_hour = df_hour.set_index('Ora').reindex(range(24), fill_value=0).reset_index()
-    
-    if is_average:
-        df_hour['numero_incidenti'] = df_hour['numero_incidenti'] / num_years
-        df_hour['morti_totali'] = df_hour['morti_totali'] / num_years
-    
-    return df_hour
+def hourly_profile(values, day_index):
+    """
+    Profilo orario (24 valori) di un giorno, oppure media settimanale se day_index è None.
+    values: array anni × giorni × ore
+    """
+    by_day = values.sum(axis=0)[:, :HOURS]
+    if day_index is None:
+        return by_day.sum(axis=0) / 7
+    return by_day[day_index]
 
-def calculate_max_hours(df_hour_all, num_years, is_average, selected_day_id):
+def process_hour_data(cube, day_index, num_years, is_average):
+    """Dati orari del giorno selezionato (o media settimanale) dal cubo"""
+    divisor = num_years if is_average else 1
+    return pd.DataFrame({
+        "Ora": np.arange(HOURS),
+        "numero_incidenti": hourly_profile(cube["incidenti"], day_index) / divisor,
+        "morti_totali": hourly_profile(cube["morti"], day_index) / divisor,
+    })
+
+def calculate_max(values, num_years, is_average, day_index):
     """
     Calcola il massimo per l'asse Y:
     - Se nessun giorno selezionato: massimo della MEDIA settimanale
     - Se giorno selezionato: massimo tra tutti i singoli giorni
     """
-    if selected_day_id:
-        # Massimo tra tutti i singoli giorni
-        max_val = df_hour_all.groupby(['day_id', 'Ora'])['numero_incidenti'].sum().max()
-    else:
-        # Media settimanale: somma per ora diviso 7, poi prendi il massimo
-        max_val = (df_hour_all.groupby('Ora')['numero_incidenti'].sum() / 7).max()
-    
+    by_day = values.sum(axis=0)[:, :HOURS]
+    if by_day.size == 0:
+        return 0
+    max_val = by_day.max() if day_index is not None else (by_day.sum(axis=0) / 7).max()
     if is_average:
         max_val = max_val / num_years
-    
     return max_val
 
-def calculate_max_deaths(df_hour_all, num_years, is_average, selected_day_id):
-    """Calcola il massimo dei morti per l'asse Y2"""
-    if selected_day_id:
-        # Massimo tra tutti i singoli giorni
-        max_val = df_hour_all.groupby(['day_id', 'Ora'])['morti_totali'].sum().max()
-    else:
-        # Media settimanale: somma per ora diviso 7, poi prendi il massimo
-        max_val = (df_hour_all.groupby('Ora')['morti_totali'].sum() / 7).max()
-    
-    if is_average:
-        max_val = max_val / num_years
-    
-    return max_val
+# =========================
+# CALENDARIO
+# =========================
+# I microdati ISTAT hanno mese e giorno della settimana ma non il giorno del mese:
+# il calendario è anno × mese × giorno della settimana, e i valori sono divisi per
+# il numero di giorni di calendario corrispondenti (media per giorno).
+
+CALENDAR_VIEWS = ["Mese × ora", "Anno × mese", "Giorno × mese", "Feriali e weekend × ora"]
+
+@cache.cached
+def load_calendar_cube(years: tuple, filters: tuple = ()):
+    """Cubo anni × mesi × giorni × ore e giorni di calendario anni × mesi × giorni (years da utils.normalize_years)"""
+    cal = store.cube("calendario", years)
+    days = (cal[["day_id", "giorno", "fine_settimana"]].drop_duplicates("day_id")
+              .astype({"day_id": int, "giorno": str, "fine_settimana": bool})
+              .sort_values("day_id")
+              .reset_index(drop=True))
+    months = (cal[["mese", "nome_mese"]].drop_duplicates("mese")
+                .astype({"mese": int, "nome_mese": str})
+                .sort_values("mese")["nome_mese"].tolist())
+    shape = (len(years), 12, len(days), HOURS + 1)
+
+    def indexes(df):
+        return (pd.Index(years).get_indexer(df["anno"]),
+                pd.to_numeric(df["mese"]).to_numpy(dtype=float, na_value=0).astype(int) - 1,
+                pd.Index(days["day_id"]).get_indexer(df["day_id"]))
+
+    year_idx, month_idx, day_idx = indexes(cal)
+    giorni = np.zeros(shape[:3])
+    giorni[year_idx, month_idx, day_idx] = cal["giorni"].to_numpy(dtype=float)
+
+    df = crossfilter.cube("calendario_ora", years, filters)
+    year_idx, month_idx, day_idx = indexes(df)
+    hours = pd.to_numeric(df["Ora"]).to_numpy(dtype=float, na_value=HOURS)
+    hour_idx = np.where((hours >= 0) & (hours < HOURS), hours, HOURS).astype(int)
+    # righe senza mese o giorno valido escluse
+    valid = (year_idx >= 0) & (month_idx >= 0) & (month_idx < 12) & (day_idx >= 0)
+    flat = np.ravel_multi_index((year_idx[valid], month_idx[valid], day_idx[valid], hour_idx[valid]), shape)
+    size = int(np.prod(shape))
+
+    def fold(col):
+        return np.bincount(flat, weights=df[col].to_numpy(dtype=float)[valid], minlength=size).reshape(shape)
+
+    return {"days": days, "months": months, "giorni": giorni,
+            "incidenti": fold("incidenti"), "morti": fold("morti")}
+
+def _per_day(values, days):
+    return np.divide(values, days, out=np.full(values.shape, np.nan), where=days > 0)
+
+def calendar_heatmap(cube, view, metric, years):
+    """Matrice della heatmap (media per giorno di calendario) con etichette di righe e colonne"""
+    values, giorni = cube[metric], cube["giorni"]
+    months, day_names = cube["months"], cube["days"]["giorno"].tolist()
+    hours = list(range(HOURS))
+    if view == "Mese × ora":
+        z = _per_day(values[..., :HOURS].sum(axis=(0, 2)), giorni.sum(axis=(0, 2))[:, None])
+        return z, hours, months
+    if view == "Anno × mese":
+        z = _per_day(values.sum(axis=(2, 3)), giorni.sum(axis=2))
+        return z, months, [str(2000 + year) for year in years]
+    if view == "Giorno × mese":
+        z = _per_day(values.sum(axis=(0, 3)).T, giorni.sum(axis=0).T)
+        return z, months, day_names
+    # feriali e weekend
+    weekend = cube["days"]["fine_settimana"].to_numpy()
+    by_day = values[..., :HOURS].sum(axis=(0, 1))
+    days_count = giorni.sum(axis=(0, 1))
+    z = np.vstack([
+        _per_day(by_day[~weekend].sum(axis=0), days_count[~weekend].sum()),
+        _per_day(by_day[weekend].sum(axis=0), days_count[weekend].sum()),
+    ])
+    return z, hours, ["Feriali", "Weekend"]
+
+def render_calendar(years, filters, display_text):
+    """Heatmap di calendario"""
+    col_view, col_metric = st.columns([3, 1])
+    with col_view:
+        view = st.radio("Heatmap", CALENDAR_VIEWS, horizontal=True, key="temp_calendar_view")
+    with col_metric:
+        metric_label = st.radio("Valore", ["Incidenti", "Morti"], horizontal=True, key="temp_calendar_metric")
+    metric = "incidenti" if metric_label == "Incidenti" else "morti"
+
+    cube = prefetch.result(load_calendar_cube, years, filters)
+    z, x, y = calendar_heatmap(cube, view, metric, years)
+    if np.size(z) == 0 or np.all(np.isnan(z)):
+        st.warning("⚠️ Nessun dato di calendario disponibile per il periodo selezionato.")
+        return
+
+    x_is_hour = view.endswith("ora")
+    fig = go.Figure(go.Heatmap(
+        z=z,
+        x=x,
+        y=y,
+        colorscale="Reds" if metric == "morti" else "Blues",
+        colorbar=dict(title=f"{metric_label}<br>al giorno", thickness=16, len=0.8),
+        hovertemplate=("<b>%{y}</b>, " + ("ore %{x}:00" if x_is_hour else "%{x}") +
+                       f"<br>{metric_label} al giorno: %{{z:.{'2f' if metric == 'morti' else '1f'}}}<extra></extra>"),
+        xgap=1,
+        ygap=1,
+    ))
+    fig.update_layout(
+        title=f"{metric_label} medi per giorno di calendario: {view.lower()} - {display_text}",
+        font=dict(size=14),
+        xaxis=dict(title="Ora del giorno" if x_is_hour else None, dtick=2 if x_is_hour else None,
+                   fixedrange=True, tickfont=dict(size=13)),
+        yaxis=dict(autorange="reversed", fixedrange=True, tickfont=dict(size=13)),
+        height=max(350, 38 * len(y) + 200),
+        margin=dict(t=80, b=60, l=60, r=60),
+        dragmode=False,
+    )
+    st.plotly_chart(fig, use_container_width=True, key="calendar_chart", config={'displayModeBar': False})
 
 def get_bar_colors(df_day, selected_day):
     """Calcola i colori delle barre"""
@@ -128,18 +218,19 @@ def get_bar_colors(df_day, selected_day):
 # =========================
 
 @st.fragment
-def render_charts(df_day, df_hour_all, num_years, is_average_temp, display_text_temp):
+def render_charts(df_day, cube, num_years, is_average_temp, display_text_temp):
        
     # === PROCESSA DATI ORARI ===
-    selected_day_id = None
+    day_index = None
     if st.session_state.selected_day:
-        selected_day_id = df_day[df_day['giorno'] == st.session_state.selected_day]['day_id'].iloc[0]
+        matches = np.flatnonzero(df_day['giorno'].to_numpy() == st.session_state.selected_day)
+        day_index = int(matches[0]) if len(matches) else None
     
-    df_hour = process_hour_data(df_hour_all, selected_day_id, num_years, is_average_temp)
+    df_hour = process_hour_data(cube, day_index, num_years, is_average_temp)
     
     # === CALCOLA MASSIMO PER ASSE Y (dipende dalla selezione) ===
-    max_incidents = calculate_max_hours(df_hour_all, num_years, is_average_temp, selected_day_id)
-    max_deaths = calculate_max_deaths(df_hour_all, num_years, is_average_temp, selected_day_id)
+    max_incidents = calculate_max(cube["incidenti"], num_years, is_average_temp, day_index)
+    max_deaths = calculate_max(cube["morti"], num_years, is_average_temp, day_index)
     
     # === GRAFICO GIORNALIERO ===
     fig_day_combo = go.Figure()
@@ -313,6 +404,14 @@ def render_charts(df_day, df_hour_all, num_years, is_average_temp, display_text_
 # MAIN FUNCTION
 # =========================
 
+def prefetch_tasks(filters):
+    """Chiamate che show() farà con lo stato attuale dei widget (per Utils/prefetch.py)"""
+    years = utils.selected_years()
+    if st.session_state.get("temp_view_mode") == "Calendario":
+        return [(load_calendar_cube, (years, filters))]
+    return [(load_temporal_cube, (years, filters))]
+
+
 def show():
     
     # CSS cursori
@@ -326,9 +425,9 @@ def show():
     </style>
     """, unsafe_allow_html=True)
     
-    available_years = utils.get_available_years()
-
     st.markdown('<div class="section-header">Giorni e orari</div>', unsafe_allow_html=True)
+    filters = crossfilter.current()
+    crossfilter.show_active("giorno_ora", filters)
 
     # Inizializza il session state
     if 'selected_day' not in st.session_state:
@@ -338,14 +437,11 @@ def show():
     col_ctrl_temp1, col_ctrl_temp2 = st.columns(2)
 
     with col_ctrl_temp1:
-        year_options_temp = ["Media di tutti gli anni"] + [2000 + year for year in sorted(available_years, reverse=True)]
-        
-        year_selection_temp = st.selectbox(
-            "Seleziona Periodo",
-            options=year_options_temp,
-            index=0,
-            help="Scegli un anno specifico o tutti gli anni per la media",
-            key="temp_year_selector"
+        view_mode_temp = st.radio(
+            "Vista",
+            options=["Settimana", "Calendario"],
+            horizontal=True,
+            key="temp_view_mode"
         )
 
     with col_ctrl_temp2:
@@ -360,22 +456,26 @@ def show():
             st.session_state.selected_day = None
             st.rerun()
 
-    # Selezione anno
-    if year_selection_temp == "Media di tutti gli anni":
-        selected_years_temp, is_average_temp, display_text_temp = available_years, True, "media periodo 2019-2023"
+    # Periodo (filtro della sidebar)
+    years = utils.selected_years()
+    is_average_temp = len(years) > 1
+    if is_average_temp:
+        display_text_temp = f"media periodo {2000 + years[0]}-{2000 + years[-1]}"
     else:
-        year_value = year_selection_temp - 2000
-        selected_years_temp, is_average_temp, display_text_temp = [year_value], False, str(year_selection_temp)
+        display_text_temp = str(2000 + years[0]) if years else ""
+
+    if years:
+        num_years = len(years)
 
-    if selected_years_temp:
-        years_str = ','.join(map(str, selected_years_temp))
-        num_years = len(selected_years_temp)
+        if view_mode_temp == "Calendario":
+            render_calendar(years, filters, display_text_temp)
+            return
         
         # === CARICA TUTTI I DATI UNA VOLTA SOLA (CACHED) ===
-        df_day_raw, df_hour_all = load_all_temporal_data(years_str)
+        cube = prefetch.result(load_temporal_cube, years, filters)
         
         # === PROCESSA DATI GIORNALIERI ===
-        df_day = process_day_data(df_day_raw, num_years if is_average_temp else 1)
+        df_day = process_day_data(day_totals(cube), num_years if is_average_temp else 1)
         
         # === RENDER GRAFICI NEL FRAGMENT (ricarica veloce) ===
-        render_charts(df_day, df_hour_all, num_years, is_average_temp, display_text_temp)
\ No newline at end of file
+        render_charts(df_day, cube, num_years, is_average_temp, display_text_temp)
\ No newline at end of file
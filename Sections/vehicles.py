@@ -1,8 +1,230 @@
+import functools
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from Utils import utils
+from Utils import utils, cache, crossfilter, prefetch
+
+
+# ordine di righe e colonne della matrice
+VEHICLE_GROUPS = [
+    "Automobile", "Motoveicolo", "Mezzo pesante", "Trasporto pubblico",
+    "Bicicletta", "Monopattino"
+]
+
+EMOJI_MAP = {
+    "Automobile": "🚗",
+    "Motoveicolo": "🏍️",
+    "Mezzo pesante": "🚚",
+    "Trasporto pubblico": "🚌",
+    "Bicicletta": "🚲",
+    "Monopattino": "🛴",
+}
+
+# colori delle heatmap
+COLORSCALE = [
+    [0.0, "#fff5f5"],
+    [0.11, "#fbb6b6"],
+    [0.33, "#f87171"],
+    [0.53, "#ef4444"],
+    [0.8, "#b91c1c"],
+    [1.0, "#7f1d1d"]
+]
+
+# coppie mostrate al massimo nel dettaglio per tipo
+TOP_PAIRS = 15
+
+
+@functools.lru_cache(maxsize=None)
+def label_with_emoji_vertical(label: str) -> str:
+    emoji = EMOJI_MAP.get(label, "")
+    return f"{emoji}\n{label}" if emoji else label
+
+
+def cell_text(z_vals, mid_val):
+    """
+    Testo delle celle come array (una sola traccia, nessuna annotazione per cella):
+    vuoto per le celle a zero, bianco sulle celle scure.
+    """
+    values = np.round(np.nan_to_num(z_vals)).astype(np.int64).astype(str)
+    colors = np.where(z_vals >= mid_val, "white", "#2d3642")
+    text = np.char.add(np.char.add(np.char.add("<span style='color:", colors), "'>"),
+                       np.char.add(values, "</span>"))
+    return np.where(z_vals > 0, text, "")
+
+
+def pair_matrix(group_a, group_b, weights, order):
+    """
+    Matrice simmetrica delle co-occorrenze in un solo passaggio: le coppie sono
+    codificate come a * k + b e contate con bincount, poi sommate alla trasposta,
+    così (A, B) conta sia per la cella (A, B) sia per (B, A).
+    I gruppi che non sono in `order` vengono ignorati.
+    """
+    k = len(order)
+    a = pd.Categorical(group_a, categories=order).codes
+    b = pd.Categorical(group_b, categories=order).codes
+    valid = (a >= 0) & (b >= 0)
+    counts = np.bincount(a[valid] * k + b[valid],
+                         weights=np.asarray(weights, dtype=float)[valid],
+                         minlength=k * k).reshape(k, k)
+    return pd.DataFrame(counts + counts.T, index=order, columns=order)
+
+
+@cache.cached
+def load_vehicle_matrix(years: tuple, filters: tuple = ()):
+    """
+    Incidenti per coppia di gruppi di veicoli, ordinati come VEHICLE_GROUPS
+    (years da utils.normalize_years, filters da crossfilter.current)
+    """
+    df_pairs = crossfilter.cube("veicoli", years, filters)
+    return pair_matrix(df_pairs["gruppoA"], df_pairs["gruppoB"], df_pairs["incidenti"], VEHICLE_GROUPS)
+
+
+# =========================
+# DETTAGLIO PER TIPO DI VEICOLO
+# =========================
+# Con tutti i tipi di veicolo la matrice è grande e quasi vuota: si tengono solo
+# le coppie presenti (formato a coordinate) e si espande un gruppo alla volta.
+
+@cache.cached
+def load_type_pairs(years: tuple, filters: tuple = ()):
+    """
+    Coppie di tipi di veicolo non ordinate (idA <= idB) con il numero di incidenti,
+    solo quelle presenti, in ordine decrescente (years da utils.normalize_years).
+    """
+    df = crossfilter.cube("veicoli", years, filters)
+    df = df[df["incidenti"] > 0]
+    a = df["idTipoVeicoloA"].to_numpy(dtype=np.int64)
+    b = df["idTipoVeicoloB"].to_numpy(dtype=np.int64)
+    swap = a > b
+    # descrizione e gruppo di ogni id, presi da entrambe le colonne del cubo
+    types = pd.concat([
+        df[["idTipoVeicoloA", "tipoA", "gruppoA"]].set_axis(["id", "tipo", "gruppo"], axis=1),
+        df[["idTipoVeicoloB", "tipoB", "gruppoB"]].set_axis(["id", "tipo", "gruppo"], axis=1),
+    ]).drop_duplicates("id").astype({"id": np.int64, "tipo": str, "gruppo": str}).set_index("id")
+
+    pairs = (pd.DataFrame({"idA": np.where(swap, b, a), "idB": np.where(swap, a, b),
+                           "n": df["incidenti"].to_numpy()})
+             .groupby(["idA", "idB"], as_index=False)["n"].sum()
+             .sort_values("n", ascending=False, ignore_index=True))
+    for side in "AB":
+        ids = pairs[f"id{side}"]
+        pairs[f"tipo{side}"] = ids.map(types["tipo"])
+        pairs[f"gruppo{side}"] = ids.map(types["gruppo"])
+    return pairs
+
+
+def top_pairs(pairs, n, group=None):
+    """Le n coppie con più incidenti, eventualmente solo quelle che coinvolgono un gruppo"""
+    if group is not None:
+        pairs = pairs[(pairs["gruppoA"] == group) | (pairs["gruppoB"] == group)]
+    return pairs.head(n)
+
+
+def expand_group(pairs, group, max_columns):
+    """
+    Matrice densa solo per il gruppo selezionato: righe = tipi del gruppo,
+    colonne = i max_columns tipi con più incidenti insieme a loro.
+    Come per i gruppi, la coppia (A, B) conta sia per (A, B) sia per (B, A).
+    """
+    both = pd.concat([
+        pairs[["tipoA", "gruppoA", "tipoB", "n"]].set_axis(["riga", "gruppo", "colonna", "n"], axis=1),
+        pairs[["tipoB", "gruppoB", "tipoA", "n"]].set_axis(["riga", "gruppo", "colonna", "n"], axis=1),
+    ])
+    cells = both[both["gruppo"] == group].groupby(["riga", "colonna"])["n"].sum()
+    if cells.empty:
+        return pd.DataFrame()
+    rows = cells.groupby(level="riga").sum().sort_values(ascending=False).index
+    columns = cells.groupby(level="colonna").sum().nlargest(max_columns).index
+    return cells.unstack(fill_value=0).reindex(index=rows, columns=columns, fill_value=0)
+
+
+def show_type_detail(years, filters, is_avg, subtitle_period):
+    """Dettaglio per tipo di veicolo: coppie più frequenti ed espansione di un gruppo"""
+    pairs = prefetch.result(load_type_pairs, years, filters)
+    if pairs.empty:
+        st.warning("⚠️ Nessun dato disponibile per il periodo selezionato.")
+        return
+    if is_avg:
+        pairs["n"] = pairs["n"] / len(years)
+
+    group = st.selectbox(
+        "Espandi gruppo:",
+        options=VEHICLE_GROUPS,
+        format_func=lambda g: f"{EMOJI_MAP.get(g, '')} {g}",
+        key="veicoli_group_detail",
+    )
+
+    # -------- COPPIE PIÙ FREQUENTI --------
+    top = top_pairs(pairs, TOP_PAIRS, group).iloc[::-1]
+    labels = top["tipoA"] + " + " + top["tipoB"]
+    fig_top = go.Figure(go.Bar(
+        x=top["n"],
+        y=labels,
+        orientation="h",
+        marker_color="#ef4444",
+        text=top["n"].round().astype(int),
+        textposition="outside",
+        hovertemplate="<b>%{y}</b><br>Incidenti: %{x:.0f}<extra></extra>",
+    ))
+    fig_top.update_layout(
+        height=max(300, 28 * len(top) + 80),
+        title=dict(
+            text=f"<span style='font-size:15px; color:#64748b;'>Coppie più frequenti con {group.lower()} – {subtitle_period}</span>",
+            x=0.5, xanchor="center",
+        ),
+        margin=dict(l=10, r=40, t=60, b=10),
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+        font=dict(family="Segoe UI", size=13, color="#222f3e"),
+        xaxis=dict(showgrid=True, gridcolor="#f3f4f6"),
+    )
+    st.plotly_chart(fig_top, use_container_width=True, config={"displayModeBar": False, "staticPlot": True})
+
+    # -------- GRUPPO ESPANSO --------
+    matrix = expand_group(pairs, group, TOP_PAIRS)
+    if matrix.empty:
+        return
+    z_vals = matrix.to_numpy(dtype=float)
+    z_max = float(z_vals.max())
+    mid_val = (z_max + float(z_vals.min())) / 2 if z_max > 0 else 0
+    fig = go.Figure(go.Heatmap(
+        z=z_vals,
+        x=list(matrix.columns),
+        y=list(matrix.index),
+        colorscale=COLORSCALE,
+        colorbar=dict(title="N° incidenti", thickness=16, len=0.8, tickfont=dict(size=12)),
+        hovertemplate=(
+            "<b>Veicolo A:</b> %{y}<br>"
+            "<b>Veicolo B:</b> %{x}<br>"
+            "<b>Incidenti:</b> %{z:.0f}<extra></extra>"
+        ),
+        text=cell_text(z_vals, mid_val),
+        texttemplate="%{text}",
+        textfont=dict(size=11),
+        zmin=0,
+        zmax=z_max if z_max > 0 else None,
+    ))
+    fig.update_xaxes(side="top", tickangle=-45)
+    fig.update_yaxes(automargin=True, autorange="reversed")
+    fig.update_layout(
+        height=max(300, 40 * len(matrix) + 200),
+        margin=dict(l=10, r=80, t=160, b=10),
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+        font=dict(family="Segoe UI", size=13, color="#222f3e"),
+    )
+    st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False, "staticPlot": True})
+
+
+def prefetch_tasks(filters):
+    """Chiamate che show() farà con lo stato attuale dei widget (per Utils/prefetch.py)"""
+    years = utils.selected_years()
+    if st.session_state.get("veicoli_detail_mode") == "Tipi di veicolo":
+        return [(load_type_pairs, (years, filters))]
+    return [(load_vehicle_matrix, (years, filters))]
+
 
 def show():
     # -------- HEADER --------
@@ -37,22 +259,20 @@ def show():
         "</div>",
         unsafe_allow_html=True
     )
+    filters = crossfilter.current()
+    crossfilter.show_active("veicoli", filters)
 
     st.write("")  # Spaziatura
 
-    # -------- SELEZIONE ANNO + Infobox --------
+    # -------- DETTAGLIO + Infobox --------
     with st.container():
         col1, col_info = st.columns([2, 1])
         with col1:
-            year_options = ["Media di tutti gli anni"] + [
-                2000 + y for y in sorted(utils.available_years, reverse=True)
-            ]
-            year_selection = st.selectbox(
-                "Seleziona periodo:",
-                options=year_options,
-                index=0,
-                help="Scegli un anno specifico o tutti gli anni per la media",
-                key="veicoli_year_selector",
+            detail = st.radio(
+                "Dettaglio:",
+                options=["Gruppi", "Tipi di veicolo"],
+                horizontal=True,
+                key="veicoli_detail_mode",
             )
 
         with col_info:
@@ -78,95 +298,35 @@ def show():
 
     st.write("")
 
-    # -------- DEFINIZIONE ANNI --------
-    if year_selection == "Media di tutti gli anni":
-        selected_years, is_avg = utils.available_years, True
-        subtitle_period = "media annua (2019–2023)"
+    # -------- PERIODO (filtro della sidebar) --------
+    years = utils.selected_years()
+    is_avg = len(years) > 1
+    if is_avg:
+        subtitle_period = f"media annua ({2000 + years[0]}–{2000 + years[-1]})"
     else:
-        selected_years, is_avg = [year_selection - 2000], False
-        subtitle_period = f"anno {year_selection}"
-
-    years_str = ",".join(map(str, selected_years))
-
-    # -------- QUERY --------
-    query = f"""
-    SELECT tipoA, tipoB, SUM(n) AS n
-    FROM (
-    SELECT va.gruppo AS tipoA, vb.gruppo AS tipoB, COUNT(*) AS n
-    FROM incidenti i
-    JOIN tipo_veicolo va ON i.idTipoVeicoloA = va.id
-    JOIN tipo_veicolo vb ON i.idTipoVeicoloB = vb.id
-    WHERE i.anno IN ({years_str})
-      AND i.idTipoVeicoloA IS NOT NULL
-      AND i.idTipoVeicoloB IS NOT NULL
-    GROUP BY va.gruppo, vb.gruppo
-
-    UNION ALL
-
-    SELECT vb.gruppo AS tipoA, va.gruppo AS tipoB, COUNT(*) AS n
-    FROM incidenti i
-    JOIN tipo_veicolo va ON i.idTipoVeicoloA = va.id
-    JOIN tipo_veicolo vb ON i.idTipoVeicoloB = vb.id
-    WHERE i.anno IN ({years_str})
-      AND i.idTipoVeicoloA IS NOT NULL
-      AND i.idTipoVeicoloB IS NOT NULL
-    GROUP BY vb.gruppo, va.gruppo
-    ) t
-    GROUP BY tipoA, tipoB
-    ORDER BY tipoA, tipoB;
-    """
-    df = utils.run_query(query)
+        subtitle_period = f"anno {2000 + years[0]}" if years else ""
 
-    if df.empty:
-        st.warning("⚠️ Nessun dato disponibile per il periodo selezionato.")
+    # -------- DATI --------
+    if detail == "Tipi di veicolo":
+        show_type_detail(years, filters, is_avg, subtitle_period)
         return
 
-    if is_avg:
-        df["n"] = df["n"] / len(selected_years)
+    matrix = prefetch.result(load_vehicle_matrix, years, filters)
 
-    # -------- COSTRUZIONE MATRICE --------
-    custom_order = [
-        "Automobile", "Motoveicolo", "Mezzo pesante", "Trasporto pubblico",
-        "Bicicletta", "Monopattino"
-    ]
+    if matrix.to_numpy().sum() == 0:
+        st.warning("⚠️ Nessun dato disponibile per il periodo selezionato.")
+        return
 
-    matrix = df.pivot_table(
-    index="tipoA",
-    columns="tipoB",
-    values="n",
-    aggfunc="sum",     
-    fill_value=0
-)
+    if is_avg:
+        matrix = matrix / len(years)
 
-    matrix = matrix.reindex(index=custom_order, columns=custom_order)
+    custom_order = VEHICLE_GROUPS
 
     # -------- ICONE --------
-    emoji_map = {
-        "Automobile": "🚗",
-        "Motoveicolo": "🏍️",
-        "Mezzo pesante": "🚚",
-        "Trasporto pubblico": "🚌",
-        "Bicicletta": "🚲",
-        "Monopattino": "🛴",
-    }
-    def label_with_emoji_vertical(label: str) -> str:
-        emoji = emoji_map.get(label, "")
-        return f"{emoji}\n{label}" if emoji else label
-
     matrix_display = matrix.copy()
     matrix_display.columns = [label_with_emoji_vertical(c) for c in matrix.columns]
     matrix_display.index = [label_with_emoji_vertical(i) for i in matrix.index]
 
-    # -------- COLORI HEATMAP --------
-    colorscale = [
-        [0.0, "#fff5f5"],   
-        [0.11, "#fbb6b6"], 
-        [0.33, "#f87171"],  
-        [0.53, "#ef4444"], 
-        [0.8, "#b91c1c"],  
-        [1.0, "#7f1d1d"]   
-    ]
-
     z_vals = matrix_display.values
     z_max = float(np.max(z_vals)) if np.size(z_vals) > 0 else 0
     z_min = float(np.min(z_vals)) if np.size(z_vals) > 0 else 0
@@ -179,7 +339,7 @@ def show():
             z=z_vals,
             x=matrix_display.columns,
             y=matrix_display.index,
-            colorscale=colorscale,
+            colorscale=COLORSCALE,
             colorbar=dict(
                 title="N° incidenti",
                 thickness=16,
@@ -192,29 +352,16 @@ def show():
                 "<b>Veicolo B:</b> %{x}<br>"
                 "<b>Incidenti:</b> %{z:.0f}<extra></extra>"
             ),
+            # valori delle celle
+            text=cell_text(z_vals, mid_val),
+            texttemplate="%{text}",
+            textfont=dict(size=12),
             showscale=True,
             zmin=0,
             zmax=z_max if z_max > 0 else None,
         )
     )
 
-    # Annotazioni valori heatmap
-    for y_idx, y_label in enumerate(matrix_display.index):
-        for x_idx, x_label in enumerate(matrix_display.columns):
-            val = matrix_display.iloc[y_idx, x_idx]
-            if val <= 0:
-                continue
-            text_color = "white" if (z_max > 0 and val >= mid_val) else "#2d3642"
-            fig.add_annotation(
-                x=x_label,
-                y=y_label,
-                text=f"{val:.0f}",
-                showarrow=False,
-                font=dict(size=12, color=text_color),
-                xanchor="center",
-                yanchor="middle",
-            )
-
     # Stile degli assi
     fig.update_xaxes(
         showticklabels=True,
@@ -0,0 +1,136 @@
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# limite di memoria della cache dei risultati (in MB), configurabile da variabile d'ambiente
+MAX_BYTES = int(os.environ.get("CACHE_MAX_MB", 256)) * 1024 * 1024
+
+
+def sizeof(value):
+    """Stima dei byte occupati da un risultato"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    """I DataFrame restituiti vengono copiati: chi li modifica non tocca la cache"""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+class LRUCache:
+    """
+    Cache LRU limitata in byte, condivisa da tutte le sessioni del processo.
+    Tiene i contatori di hit/miss/evict per funzione.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.stats = {}
+
+    def _count(self, name, event):
+        counters = self.stats.setdefault(name, {"hits": 0, "misses": 0, "evictions": 0})
+        counters[event] += 1
+
+    def get(self, key):
+        """Restituisce (True, valore) oppure (False, None)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(key[0], "hits")
+                return True, self._entries[key][0]
+            self._count(key[0], "misses")
+            return False, None
+
+    def put(self, key, value):
+        nbytes = sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            # rimuove le voci usate meno di recente, mai quella appena inserita
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, (_, old_bytes) = self._entries.popitem(last=False)
+                self.bytes -= old_bytes
+                self._count(old_key[0], "evictions")
+
+    def clear(self, predicate=None):
+        """Svuota la cache, oppure solo le chiavi (nome, args, kwargs) per cui predicate è vero"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def invalidate_years(self, years):
+        """
+        Rimuove i risultati che dipendono dagli anni indicati: le voci con fra gli
+        argomenti una tupla di anni che li contiene, e quelle senza anni (calcolate su tutto).
+        """
+        years = set(years)
+
+        def depends(key):
+            periods = [arg for arg in key[1] if isinstance(arg, tuple)]
+            return not periods or any(years.intersection(period) for period in periods)
+
+        self.clear(depends)
+
+    def entries(self):
+        """Voci in cache (dalla meno alla più recente) come DataFrame"""
+        with self._lock:
+            rows = [(key[0], repr(key[1:]), nbytes) for key, (_, nbytes) in self._entries.items()]
+        return pd.DataFrame(rows, columns=["funzione", "argomenti", "byte"])
+
+    def summary(self):
+        """Contatori per funzione come DataFrame"""
+        with self._lock:
+            df = pd.DataFrame.from_dict(self.stats, orient="index", columns=["hits", "misses", "evictions"])
+        df.index.name = "funzione"
+        requests = df["hits"] + df["misses"]
+        df["hit_rate"] = (df["hits"] / requests.where(requests > 0)).fillna(0)
+        return df.reset_index()
+
+
+CACHE = LRUCache()
+
+
+def cached(func):
+    """
+    Sostituisce @st.cache_data: memorizza il risultato in CACHE usando come chiave
+    il nome della funzione e i suoi argomenti (che devono essere hashabili).
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        found, value = CACHE.get(key)
+        if not found:
+            value = func(*args, **kwargs)
+            CACHE.put(key, value)
+        return _copy(value)
+
+    return wrapper
@@ -0,0 +1,192 @@
+import streamlit as st
+
+from Utils import utils, store, facts
+
+# =========================
+# FILTRI INCROCIATI
+# =========================
+# Stato dei filtri condiviso da tutte le sezioni. Il periodo (cf_anno) si sceglie nella
+# sidebar e le sezioni lo leggono con utils.selected_years. Il giorno è quello cliccato nel
+# grafico dei giorni (selected_day); regione, provincia, gruppo di veicoli e sesso si
+# scelgono nella sidebar (la regione anche dalla mappa, con "Filtra le altre sezioni":
+# il solo click sulla mappa resta locale alla sezione geografica, selected_region).
+
+# filtri che ogni cubo ignora perché sono le dimensioni che il cubo stesso mostra
+CUBE_DIMENSIONS = {
+    "province": {"regione", "provincia"},
+    "giorno_ora": {"giorno"},
+    "calendario_ora": {"giorno"},
+    "veicoli": {"gruppo"},
+    "conducenti": {"sesso"},
+}
+
+LABELS = {"regione": "Regione", "provincia": "Provincia", "giorno": "Giorno", "gruppo": "Veicolo", "sesso": "Sesso"}
+
+# idSesso dei cubi (DatabaseCreation.ROLLUPS["cubo_conducenti"])
+SESSI = {1: "M", 2: "F"}
+
+
+def _regions():
+    return store.cube("regioni").sort_values("regione")
+
+def _provinces(region_id):
+    df = store.cube("province")
+    return (df[df["idRegione"] == region_id][["idProvincia", "provincia"]]
+            .drop_duplicates("idProvincia")
+            .sort_values("provincia"))
+
+def _days():
+    df = store.cube("giorno_ora")
+    return (df[df["giorno"].notna()][["day_id", "giorno"]]
+            .drop_duplicates("day_id")
+            .astype({"giorno": str})
+            .sort_values("day_id"))
+
+def _groups():
+    df = store.cube("veicoli")
+    return sorted(set(df["gruppoA"].astype(str)) | set(df["gruppoB"].astype(str)))
+
+
+def current():
+    """
+    Filtri attivi come tupla ordinata di coppie (filtro, valore): hashabile,
+    quindi usabile come argomento delle funzioni in cache. Il periodo non è qui:
+    le funzioni in cache ricevono già gli anni (utils.selected_years).
+    """
+    state = st.session_state
+    filters = {}
+    if state.get("cf_regione"):
+        filters["regione"] = state.cf_regione
+        province = state.get("cf_provincia")
+        if province is not None and province in set(_provinces(filters["regione"])["idProvincia"].astype(int)):
+            filters["provincia"] = province
+    if state.get("selected_day"):
+        days = _days()
+        match = days[days["giorno"] == state.selected_day]["day_id"]
+        if len(match):
+            filters["giorno"] = int(match.iloc[0])
+    if state.get("cf_gruppo"):
+        filters["gruppo"] = state.cf_gruppo
+    if state.get("cf_sesso"):
+        filters["sesso"] = state.cf_sesso
+    return tuple(sorted(filters.items()))
+
+
+def for_cube(name, filters):
+    """I filtri che si applicano al cubo `name` (senza quelli sulle sue dimensioni)"""
+    return tuple((key, value) for key, value in filters if key not in CUBE_DIMENSIONS[name])
+
+
+def cube(name, years, filters=()):
+    """
+    Cubo `name` (come store.cube) per gli anni indicati, tagliato dai filtri incrociati.
+    Senza filtri applicabili si usa il cubo precalcolato; altrimenti si ricalcola
+    dai fatti in memoria con l'intersezione delle bitmap.
+    """
+    conditions = dict(for_cube(name, filters))
+    if not conditions:
+        return store.cube(name, years)
+    return facts.filtered_cube(name, years, conditions)
+
+
+def describe(filters):
+    """Testo leggibile dei filtri (es. "Regione: Lombardia · Sesso: F")"""
+    def name(key, value):
+        if key == "regione":
+            df = _regions()
+            return dict(zip(df["idRegione"].astype(int), df["regione"].astype(str))).get(value, value)
+        if key == "provincia":
+            df = store.cube("province")
+            return dict(zip(df["idProvincia"].astype(int), df["provincia"].astype(str))).get(value, value)
+        if key == "giorno":
+            df = _days()
+            return dict(zip(df["day_id"], df["giorno"])).get(value, value)
+        if key == "sesso":
+            return SESSI.get(value, value)
+        return value
+
+    ordered = sorted(filters, key=lambda item: list(LABELS).index(item[0]))
+    return " · ".join(f"{LABELS[key]}: {name(key, value)}" for key, value in ordered)
+
+
+def show_active(name, filters):
+    """Nota sotto il titolo di una sezione con i filtri incrociati che la stanno tagliando"""
+    applied = for_cube(name, filters)
+    if applied:
+        st.caption(f"🔎 Filtri attivi: {describe(applied)}")
+
+
+def set_region(region_id):
+    """
+    Imposta (o toglie, con None) il filtro sulla regione e allinea la selezione
+    della mappa; la provincia scelta prima non vale più. Serve un rerun completo.
+    """
+    state = st.session_state
+    state.pop("cf_provincia", None)
+    if region_id is None:
+        state.pop("cf_regione", None)
+        state.pop("selected_region", None)
+    else:
+        state.cf_regione = int(region_id)
+        state.selected_region = f"{int(region_id):02d}"
+    state.map_version = state.get("map_version", 0) + 1
+
+
+def _select(label, options, current_value, format_func, all_label="Tutti"):
+    """Selectbox senza chiave: l'indice segue lo stato anche quando cambia da un'altra sezione"""
+    values = [None] + list(options)
+    labels = [all_label] + [format_func(v) for v in options]
+    index = values.index(current_value) if current_value in values else 0
+    choice = st.sidebar.selectbox(label, labels, index=index)
+    return values[labels.index(choice)]
+
+
+def sidebar():
+    """Pannello dei filtri incrociati nella sidebar"""
+    state = st.session_state
+    st.sidebar.markdown('<div class="sidebar-title">Filtri</div>', unsafe_allow_html=True)
+
+    years = [2000 + year for year in sorted(utils.available_years, reverse=True)]
+    choice = _select("Periodo", years, state.get("cf_anno"), str, "Tutti gli anni")
+    if choice != state.get("cf_anno"):
+        state.cf_anno = choice
+        st.rerun()
+
+    regions = _regions()
+    region_names = dict(zip(regions["idRegione"].astype(int), regions["regione"].astype(str)))
+    region = state.get("cf_regione")
+    choice = _select("Regione", region_names, region, region_names.get, "Tutte")
+    if choice != region:
+        set_region(choice)
+        st.rerun()
+
+    if region is not None:
+        provinces = _provinces(region)
+        province_names = dict(zip(provinces["idProvincia"].astype(int), provinces["provincia"].astype(str)))
+        choice = _select("Provincia", province_names, state.get("cf_provincia"), province_names.get, "Tutte")
+        if choice != state.get("cf_provincia"):
+            state.cf_provincia = choice
+            st.rerun()
+
+    days = _days()
+    choice = _select("Giorno della settimana", days["giorno"], state.get("selected_day"), str)
+    if choice != state.get("selected_day"):
+        state.selected_day = choice
+        st.rerun()
+
+    choice = _select("Veicolo coinvolto", _groups(), state.get("cf_gruppo"), str)
+    if choice != state.get("cf_gruppo"):
+        state.cf_gruppo = choice
+        st.rerun()
+
+    choice = _select("Sesso di un conducente", SESSI, state.get("cf_sesso"), SESSI.get)
+    if choice != state.get("cf_sesso"):
+        state.cf_sesso = choice
+        st.rerun()
+
+    if (current() or state.get("cf_anno")) and st.sidebar.button("Azzera filtri", use_container_width=True):
+        for key in ["cf_anno", "cf_gruppo", "cf_sesso"]:
+            state.pop(key, None)
+        state.selected_day = None
+        set_region(None)
+        st.rerun()
@@ -0,0 +1,106 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+DB_PATH = "dbAccidents.db"
+
+# connessioni aperte al massimo contemporaneamente
+POOL_SIZE = 4
+
+# statement preparati tenuti in cache da ogni connessione
+CACHED_STATEMENTS = 256
+
+# il database è in sola lettura e non cambia mentre la dashboard gira
+PRAGMAS = [
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",  # 256 MB mappati in memoria
+    "PRAGMA cache_size = -65536",    # 64 MB di page cache per connessione
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def file_signature(db_path=DB_PATH):
+    """
+    Identifica la versione del file: DatabaseCreation --aggiungi-anno sostituisce
+    il database con un nuovo file, quindi cambiano inode e data di modifica.
+    """
+    stat = os.stat(db_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def connect(db_path=DB_PATH):
+    """Nuova connessione read-only al database della dashboard"""
+    conn = sqlite3.connect(
+        f"file:{db_path}?mode=ro&immutable=1",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool di connessioni read-only condiviso fra i thread degli script Streamlit.
+    Ogni connessione è usata da un solo thread alla volta; le connessioni
+    (e i loro statement preparati) sopravvivono ai rerun.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=POOL_SIZE):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        # attende uno slot libero, poi riusa una connessione inattiva o ne apre una
+        self._slots.get()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = connect(self.db_path)
+            except Exception:
+                self._slots.put(None)
+                raise
+        try:
+            yield conn
+        finally:
+            # dopo close() (database sostituito) le connessioni in uso vengono chiuse al rilascio
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+            self._slots.put(None)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+@st.cache_resource
+def get_pool():
+    return ConnectionPool()
+
+
+def read_sql(query, params=()):
+    """Esegue una query con una connessione del pool e restituisce un DataFrame"""
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn, params=params)
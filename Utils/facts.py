@@ -0,0 +1,158 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from Utils import db, store
+
+# =========================
+# FATTI IN MEMORIA
+# =========================
+# Una riga per incidente dalla vista fatti (DatabaseCreation.SCHEMA), con le colonne
+# già codificate come nei cubi, più gli indici bitmap costruiti con il database.
+# Servono quando un filtro incrociato (Utils/crossfilter.py) taglia un cubo su una
+# dimensione che il cubo non ha, o per contare combinazioni di condizioni.
+FACTS_QUERY = "SELECT * FROM fatti ORDER BY id"
+BITMAPS_QUERY = "SELECT colonna, valore, bitmap FROM bitmap_indici"
+
+# numero di bit a 1 di ogni byte
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class FactStore:
+    """
+    Fatti in memoria con un indice bitmap (bit compressi con np.packbits) per ogni
+    valore delle colonne di DatabaseCreation.BITMAP_COLUMNS: il bit i è la riga i
+    dei fatti. Le condizioni sono {indice: valore o lista di valori}: valori in OR,
+    indici diversi in AND.
+
+        facts.count({"sesso": 1})                        # incidenti con un conducente maschio
+        facts.ids({"anno": [22, 23], "gruppo": "Bicicletta", "ora": 8})
+    """
+
+    def __init__(self, rows, bitmaps):
+        self.rows = rows
+        self.n = len(rows)
+        self.bitmaps = bitmaps  # indice -> valore -> bitmap
+
+    def _empty(self):
+        return np.zeros((self.n + 7) // 8, dtype=np.uint8)
+
+    def bitmap(self, name, values):
+        """Bitmap delle righe con uno dei valori indicati (OR)"""
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        bits = self._empty()
+        for value in values:
+            bits |= self.bitmaps[name].get(value, 0)
+        return bits
+
+    def mask(self, conditions):
+        """AND delle bitmap delle condizioni; None se non ci sono condizioni"""
+        bits = None
+        for name, values in conditions.items():
+            current = self.bitmap(name, values)
+            bits = current if bits is None else bits & current
+        return bits
+
+    def count(self, conditions):
+        """Numero di incidenti che soddisfano tutte le condizioni"""
+        bits = self.mask(conditions)
+        return self.n if bits is None else int(POPCOUNT[bits].sum(dtype=np.int64))
+
+    def positions(self, conditions):
+        """Posizioni (nei fatti) delle righe che soddisfano tutte le condizioni"""
+        bits = self.mask(conditions)
+        if bits is None:
+            return np.arange(self.n)
+        return np.flatnonzero(np.unpackbits(bits, count=self.n))
+
+    def ids(self, conditions):
+        """id della tabella incidenti delle righe che soddisfano tutte le condizioni"""
+        return self.rows["id"].to_numpy()[self.positions(conditions)]
+
+    def select(self, conditions):
+        """Righe (DataFrame) che soddisfano tutte le condizioni"""
+        if not conditions:
+            return self.rows
+        return self.rows.take(self.positions(conditions))
+
+
+def _load_bitmaps(n):
+    bitmaps = {}
+    for name, value, blob in db.read_sql(BITMAPS_QUERY).itertuples(index=False, name=None):
+        bits = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+        assert len(bits) == (n + 7) // 8, "indici bitmap non allineati ai fatti: ricostruire il database"
+        bitmaps.setdefault(name, {})[value] = bits
+    return bitmaps
+
+
+def _compact(df):
+    """Colonne codificate -> tipi interi piccoli, testo -> categorie"""
+    for col in df.columns:
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            df[col] = values.astype("category")
+        elif values.isna().any():
+            df[col] = values.astype("Int16")
+        else:
+            df[col] = pd.to_numeric(values, downcast="integer")
+    df["conB"] = df["conB"].astype(bool)
+    return df
+
+
+@st.cache_resource
+def load_facts():
+    """Caricati una sola volta per processo, alla prima richiesta (o dal warm-up)"""
+    rows = _compact(db.read_sql(FACTS_QUERY))
+    return FactStore(rows, _load_bitmaps(len(rows)))
+
+
+# =========================
+# CUBI DAI FATTI
+# =========================
+# Stesse chiavi e misure dei cubi di Utils/store.py, ma calcolati sulle righe filtrate.
+CUBE_KEYS = {
+    "province": ["anno", "idProvincia"],
+    "giorno_ora": ["anno", "day_id", "Ora"],
+    "calendario_ora": ["anno", "mese", "day_id", "Ora"],
+    "veicoli": ["anno", "idTipoVeicoloA", "idTipoVeicoloB"],
+    "conducenti": ["anno", "ruolo", "idFascia", "idSesso"],
+}
+
+
+def _aggregate(name, rows):
+    keys = CUBE_KEYS[name]
+    if name == "veicoli":
+        rows = rows[rows["idTipoVeicoloA"].notna() & rows["idTipoVeicoloB"].notna()]
+        return rows.groupby(keys, as_index=False).size().rename(columns={"size": "incidenti"})
+    if name == "conducenti":
+        # un conducente per veicolo: A sempre, B solo se il veicolo B è presente
+        drivers = pd.concat([
+            rows[["anno", "fasciaA", "sessoA"]].set_axis(["anno", "idFascia", "idSesso"], axis=1).assign(ruolo="A"),
+            rows.loc[rows["conB"], ["anno", "fasciaB", "sessoB"]].set_axis(["anno", "idFascia", "idSesso"], axis=1).assign(ruolo="B"),
+        ])
+        return drivers.groupby(keys, as_index=False).size().rename(columns={"size": "conducenti"})
+    return (rows.groupby(keys, dropna=False, as_index=False)
+                .agg(incidenti=("morti", "size"), morti=("morti", "sum")))
+
+
+def filtered_cube(name, years, conditions):
+    """
+    Cubo `name` di Utils/store.py ristretto agli anni e alle righe che soddisfano
+    le condizioni: stesse righe e colonne, con le misure ricalcolate (0 se nessun incidente).
+    """
+    facts = load_facts()
+    rows = facts.select({"anno": list(years), **conditions})
+    counts = _aggregate(name, rows)
+
+    base = store.cube(name, years)
+    keys = CUBE_KEYS[name]
+    measures = [col for col in counts.columns if col not in keys]
+    # chiavi dello stesso tipo nei due frame, così il merge trova anche i valori nulli
+    left = base.drop(columns=measures).astype({col: "Int64" if col != "ruolo" else str for col in keys})
+    right = counts.astype({col: "Int64" if col != "ruolo" else str for col in keys})
+    out = left.merge(right, on=keys, how="left")
+    out[measures] = out[measures].fillna(0).astype(np.int64)
+    return out
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from Utils import db
+
+# =========================
+# PREFETCH DEI DATI DELLE SEZIONI
+# =========================
+# All'inizio di ogni esecuzione completa della dashboard le chiamate in cache di tutte
+# le sezioni (con il periodo e i filtri che le sezioni useranno) partono insieme su un
+# pool di thread; ogni sezione poi prende il risultato già pronto (o in arrivo) invece di
+# ricalcolarlo. Le query usano il pool read-only di Utils/db.py: non servono più
+# thread che connessioni.
+PREFETCH_WORKERS = db.POOL_SIZE
+
+
+@st.cache_resource
+def get_executor():
+    """Pool di thread condiviso da tutte le sessioni"""
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def start(tasks):
+    """
+    Avvia le chiamate [(funzione, argomenti)] e ne tiene i future nella sessione.
+    Gli argomenti vanno passati come nelle sezioni, così coincidono con result().
+    """
+    executor = get_executor()
+    st.session_state["prefetch_futures"] = {
+        (func, args): executor.submit(func, *args) for func, args in tasks
+    }
+
+
+def result(func, *args):
+    """
+    Risultato di func(*args): dal future del prefetch se c'è, altrimenti calcolato qui
+    (es. nei rerun di una sola sezione, quando il prefetch non è ripartito).
+    """
+    future = st.session_state.get("prefetch_futures", {}).pop((func, args), None)
+    if future is None:
+        return func(*args)
+    return future.result()
@@ -0,0 +1,84 @@
+import pandas as pd
+import streamlit as st
+
+from Utils import db
+
+# =========================
+# CUBI IN MEMORIA
+# =========================
+# I cubi di DatabaseCreation.ROLLUPS già uniti alle tabelle di dimensione,
+# così le sezioni possono raggrupparli senza altre query.
+STORE_QUERIES = {
+    "province": """
+        SELECT c.anno, c.idProvincia, pr.provincia, pr.popolazione,
+               pr.idRegione, pr.regione, r.Area, c.incidenti, c.morti
+        FROM cubo_provincia c
+        LEFT JOIN province_regioni pr ON c.idProvincia = pr.idProvincia
+        LEFT JOIN regioni r ON pr.idRegione = r.id
+    """,
+    "regioni": """
+        SELECT id AS idRegione, regione, Area, popolazione
+        FROM regioni
+    """,
+    "giorno_ora": """
+        SELECT c.anno, c.idGiorno AS day_id, g.giorno, c.Ora, c.incidenti, c.morti
+        FROM cubo_giorno_ora c
+        LEFT JOIN giorno g ON c.idGiorno = g.id
+    """,
+    "calendario_ora": """
+        SELECT anno, Mese AS mese, idGiorno AS day_id, Ora, incidenti, morti
+        FROM cubo_calendario_ora
+    """,
+    "calendario": """
+        SELECT c.anno, c.mese, c.nome_mese, c.idGiorno AS day_id, g.giorno, c.giorni, c.fine_settimana
+        FROM calendario c
+        JOIN giorno g ON c.idGiorno = g.id
+    """,
+    "veicoli": """
+        SELECT c.anno, c.idTipoVeicoloA, c.idTipoVeicoloB,
+               va.gruppo AS gruppoA, vb.gruppo AS gruppoB,
+               va.descrizione AS tipoA, vb.descrizione AS tipoB, c.incidenti
+        FROM cubo_veicoli c
+        JOIN tipo_veicolo va ON c.idTipoVeicoloA = va.id
+        JOIN tipo_veicolo vb ON c.idTipoVeicoloB = vb.id
+    """,
+    "conducenti": """
+        SELECT anno, ruolo, idFascia, idSesso, conducenti
+        FROM cubo_conducenti
+    """,
+    "fasce_eta": """
+        SELECT id AS idFascia, fascia, minorenne
+        FROM fascia_eta
+    """,
+}
+
+
+def _compact(df):
+    """Testo -> categorie, numeri -> il tipo intero più piccolo che li contiene"""
+    for col in df.columns:
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            df[col] = values.astype("category")
+        elif (values.dropna() % 1 == 0).all():
+            if values.isna().any():
+                df[col] = values.astype("Int32")
+            else:
+                df[col] = pd.to_numeric(values, downcast="integer")
+    return df
+
+
+@st.cache_resource
+def load_store():
+    """
+    Carica i cubi una sola volta per processo: l'oggetto restituito è condiviso
+    da tutte le sessioni e non va modificato sul posto.
+    """
+    return {name: _compact(db.read_sql(query)) for name, query in STORE_QUERIES.items()}
+
+
+def cube(name, years=None):
+    """Cubo `name`, eventualmente ristretto agli anni (a 2 cifre) indicati"""
+    df = load_store()[name]
+    if years is None or "anno" not in df.columns:
+        return df
+    return df[df["anno"].isin(years)]
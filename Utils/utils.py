@@ -1,40 +1,101 @@
+import threading
+
 import streamlit as st
-import sqlite3
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 import matplotlib.colors as mcolors
+from Utils import db, store, cache, facts
 
 # =========================
 # FUNZIONI UTILITY
 # =========================
-@st.cache_data
-
-def run_query(query):
-    with sqlite3.connect("dbAccidents.db") as conn:
-        return pd.read_sql_query(query, conn)
+def normalize_years(years):
+    """
+    Anni selezionati -> tupla ordinata e senza duplicati, da usare come argomento
+    delle funzioni in cache: la stessa selezione produce sempre la stessa chiave.
+    """
+    return tuple(sorted({int(year) for year in years}))
 
 def load_yearly_accident_data_from_db():
-    conn = sqlite3.connect("dbAccidents.db")
-    query = """
-    SELECT
-        2000 + anno as Anno,
-        COUNT(*) AS total_incidents,
-        SUM(Morti) AS total_deaths
-    FROM incidenti
-    GROUP BY anno
-    ORDER BY anno;
-    """
-    df_yearly = pd.read_sql_query(query, conn)
-    conn.close()
-    return df_yearly
+    df_yearly = (store.cube("province")
+                 .groupby("anno", as_index=False)[["incidenti", "morti"]].sum()
+                 .sort_values("anno"))
+    return pd.DataFrame({
+        "Anno": 2000 + df_yearly["anno"].astype(int),
+        "total_incidents": df_yearly["incidenti"],
+        "total_deaths": df_yearly["morti"],
+    })
 
-@st.cache_data
+@cache.cached
 def get_available_years():
     """Ottiene gli anni disponibili nel database"""
-    conn = sqlite3.connect("dbAccidents.db")
-    query = "SELECT DISTINCT anno FROM incidenti ORDER BY anno DESC;"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df['anno'].tolist()
+    years = store.cube("province")["anno"].unique()
+    return sorted((int(year) for year in years), reverse=True)
+
+_db_state = {"signature": None, "loaded": None}
+_db_lock = threading.Lock()
+
+def _loaded_years():
+    """Anno -> data di caricamento, oppure None se il database non ha anni_caricati"""
+    try:
+        df = db.read_sql("SELECT anno, caricato_il FROM anni_caricati")
+    except Exception:
+        return None
+    return dict(zip(df["anno"].astype(int), df["caricato_il"]))
+
+def refresh_if_database_changed():
+    """
+    Controlla se il file del database è stato sostituito (es. da DatabaseCreation
+    --aggiungi-anno). In quel caso riapre le connessioni, ricarica i cubi e toglie
+    dalla cache solo i risultati degli anni aggiunti o ricaricati.
+    Restituisce True se il database è cambiato.
+    """
+    global available_years
+    signature = db.file_signature()
+    with _db_lock:
+        if _db_state["signature"] is None:
+            _db_state["signature"], _db_state["loaded"] = signature, _loaded_years()
+            return False
+        if signature == _db_state["signature"]:
+            return False
+
+        db.get_pool().close()
+        db.get_pool.clear()
+        store.load_store.clear()
+        facts.load_facts.clear()
+
+        old, new = _db_state["loaded"], _loaded_years()
+        if old is None or new is None:
+            cache.CACHE.clear()
+        else:
+            changed = {year for year in old.keys() | new.keys() if old.get(year) != new.get(year)}
+            cache.CACHE.invalidate_years(changed)
+
+        _db_state["signature"], _db_state["loaded"] = signature, new
+        available_years = get_available_years()
+        return True
+
+def rerun_section():
+    """
+    Riesegue solo il fragment della sezione che ha ricevuto l'interazione;
+    se la pagina è in un'esecuzione completa (non di fragment), riesegue tutto.
+    """
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+def selected_years():
+    """
+    Anni del periodo scelto nei filtri della sidebar (cf_anno, Utils/crossfilter.py):
+    l'anno selezionato, oppure tutti gli anni disponibili.
+    """
+    year = st.session_state.get("cf_anno")
+    if year is not None and year - 2000 in available_years:
+        return normalize_years([year - 2000])
+    return normalize_years(available_years)
+
 
 def parse_year_selection(year_selection, available_years):
     """
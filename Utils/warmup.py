@@ -0,0 +1,58 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from Utils import utils, store, facts
+import Sections.geography as geography
+import Sections.time as time
+import Sections.vehicles as vehicles
+import Sections.drivers as drivers
+
+WARMUP_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def warmup_tasks():
+    """
+    Tutte le chiamate in cache che una pagina può fare: per ogni periodo selezionabile
+    (ogni anno + la media di tutti gli anni) e per ogni vista. Gli argomenti sono
+    passati come nelle sezioni, così le chiavi di cache coincidono.
+    """
+    periods = [(year,) for year in utils.available_years] + [utils.normalize_years(utils.available_years)]
+
+    # i fatti servono solo con un filtro incrociato attivo, ma caricarli richiede qualche secondo
+    tasks = [(facts.load_facts, ())]
+    tasks += [(geography.geojson_source, (view_mode,)) for view_mode in geography.GEO_VIEWS]
+    for years in periods:
+        tasks += [(geography.get_geo_frame, (view_mode, years, ())) for view_mode in geography.GEO_VIEWS]
+        tasks.append((geography.get_region_province_index, (years, ())))
+        tasks.append((time.load_temporal_cube, (years, ())))
+        tasks.append((time.load_calendar_cube, (years, ())))
+        tasks.append((vehicles.load_vehicle_matrix, (years, ())))
+        tasks.append((vehicles.load_type_pairs, (years, ())))
+        tasks.append((drivers.load_sesso_conducenti, (years, ())))
+        tasks.append((drivers.load_eta_conducenti, (years, ())))
+    return tasks
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        # un file mancante (es. GeoJSON province) non deve fermare il resto del warm-up
+        logger.exception("warm-up %s%s", func.__name__, args)
+
+
+@st.cache_resource
+def start_warmup():
+    """
+    Avviato una sola volta per processo, alla prima esecuzione di main.py:
+    carica i cubi e riempie la cache in background, senza bloccare la pagina.
+    """
+    store.load_store()
+    executor = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+    futures = [executor.submit(_run, func, args) for func, args in warmup_tasks()]
+    executor.shutdown(wait=False)
+    return futures
@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -9,7 +10,7 @@ import plotly.io as pio
 import numpy as np
 import matplotlib.colors as mcolors
 from plotly.subplots import make_subplots
-from Utils import utils
+from Utils import utils, warmup, crossfilter, prefetch
 import Sections.overview as overview
 import Sections.geography as geography
 import Sections.time as time 
@@ -40,6 +41,53 @@ def local_css(file_name):
 
 local_css("style.css")
 
+# dopo un DatabaseCreation --aggiungi-anno il warm-up riparte con i nuovi anni
+if utils.refresh_if_database_changed():
+    warmup.start_warmup.clear()
+
+# riempie la cache di tutti i periodi/viste in background (una volta per processo)
+warmup.start_warmup()
+
+
+# =========================
+# SEZIONI DELLA DASHBOARD
+# =========================
+# (ancora, titolo, funzione) nell'ordine della pagina; le ancore sono quelle dei link nella sidebar
+SECTIONS = [
+    ("panoramica",        "Panoramica",               overview.show),
+    ("geografia",         "Distribuzione Geografica", geography.show),
+    ("analisi-temporale", "Giorni e orari",           time.show),
+    ("veicoli",           "Veicoli",                  vehicles.show),
+    ("conducenti",        "Profilo conducenti",       drivers.show),
+]
+
+# chiamate in cache di ogni sezione, avviate insieme prima di disegnare la pagina
+PREFETCH = {
+    "geografia":         geography.prefetch_tasks,
+    "analisi-temporale": time.prefetch_tasks,
+    "veicoli":           vehicles.prefetch_tasks,
+    "conducenti":        drivers.prefetch_tasks,
+}
+
+
+@st.fragment
+def render_section(anchor, title, show, lazy):
+    """
+    Ogni sezione è un fragment: un widget della sezione riesegue solo la sezione,
+    non le altre quattro. In modalità su richiesta la sezione non calcola nulla
+    finché non viene aperta (poi resta aperta per tutta la sessione).
+    """
+    opened = st.session_state.setdefault("opened_sections", set())
+    if lazy and anchor not in opened:
+        placeholder = st.empty()
+        with placeholder.container():
+            st.markdown(f'<div class="section-header">{title}</div>', unsafe_allow_html=True)
+            if not st.button(f"Mostra {title.lower()}", key=f"open_{anchor}"):
+                return
+        placeholder.empty()
+        opened.add(anchor)
+    show()
+
 
 # =========================
 # PAGINA 1: DASHBOARD PRINCIPALE
@@ -74,30 +122,24 @@ def page_dashboard():
     </ul>
     """, unsafe_allow_html=True)
 
-    # ---------- SEZIONE 1: OVERVIEW ----------
-    st.markdown("<a id='panoramica'></a>", unsafe_allow_html=True)
-    overview.show()
-    st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
-
-    # ---------- SEZIONE 2: GEOGRAFIA ----------
-    st.markdown("<a id='geografia'></a>", unsafe_allow_html=True)
-    geography.show()
-    st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
-
-    # ---------- SEZIONE 3: TEMPO ----------
-    st.markdown("<a id='analisi-temporale'></a>", unsafe_allow_html=True)
-    time.show()
-    st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
-
-    # ---------- SEZIONE 4: VEICOLI ----------
-    st.markdown("<a id='veicoli'></a>", unsafe_allow_html=True)
-    vehicles.show()
-    st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
-
-    # ---------- SEZIONE 5: CONDUCENTI ----------
-    st.markdown("<a id='conducenti'></a>", unsafe_allow_html=True)
-    drivers.show()
-    st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
+    # filtri incrociati condivisi da tutte le sezioni
+    crossfilter.sidebar()
+
+    # ---------- SEZIONI ----------
+    lazy = st.sidebar.toggle("Carica le sezioni su richiesta", key="lazy_sections",
+                             help="Le sezioni dopo la panoramica vengono calcolate solo quando si aprono")
+
+    # ---------- PREFETCH ----------
+    # i dati delle sezioni visibili si calcolano in parallelo mentre la pagina viene disegnata
+    filters = crossfilter.current()
+    opened = st.session_state.get("opened_sections", set())
+    prefetch.start([task for anchor, tasks in PREFETCH.items()
+                    if not lazy or anchor in opened
+                    for task in tasks(filters)])
+    for anchor, title, show in SECTIONS:
+        st.markdown(f"<a id='{anchor}'></a>", unsafe_allow_html=True)
+        render_section(anchor, title, show, lazy and anchor != "panoramica")
+        st.markdown("<div style='height:60px;'></div>", unsafe_allow_html=True)
 
     # ---------- FOOTER ----------
     st.markdown("""
@@ -129,6 +171,14 @@ def page_info():
     info.show()
 
 
+# =========================
+# PAGINA 3: DEBUG CACHE (solo con DASHBOARD_DEBUG=1)
+# =========================
+def page_debug():
+    import pages.debug as debug
+    debug.show()
+
+
 # =========================
 # NAVIGAZIONE A 2 PAGINE
 # =========================
@@ -138,5 +188,8 @@ pages = [
     st.Page(page_info,      title="Info e metodologie",          icon="🔍"),
 ]
 
+if os.environ.get("DASHBOARD_DEBUG") == "1":
+    pages.append(st.Page(page_debug, title="Debug cache", icon="🛠️"))
+
 nav = st.navigation(pages)
 nav.run()
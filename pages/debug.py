@@ -0,0 +1,23 @@
+# Stato della cache dei risultati
+
+import streamlit as st
+from Utils.cache import CACHE
+
+
+def show():
+    st.markdown("### Cache dei risultati")
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Memoria usata", f"{CACHE.bytes / 1024 / 1024:.1f} MB")
+    col2.metric("Limite", f"{CACHE.max_bytes / 1024 / 1024:.0f} MB")
+    col3.metric("Voci", len(CACHE.entries()))
+
+    st.markdown("#### Contatori per funzione")
+    st.dataframe(CACHE.summary(), use_container_width=True, hide_index=True)
+
+    st.markdown("#### Voci in cache (dalla meno recente)")
+    st.dataframe(CACHE.entries(), use_container_width=True, hide_index=True)
+
+    if st.button("Svuota cache"):
+        CACHE.clear()
+        st.rerun()